@@ -24,8 +24,8 @@ This application is CUI filer of the keyboard operation for Linux.
 __author__ = "anmitsu <anmitsu.s@gmail.com>"
 __version__ = "0.2.2"
 
-__all__ = ["cmdline", "command", "filectrl", "filer", "help", "look", "menu",
-           "message", "mode", "process", "util", "completion", "widget"]
+__all__ = ["cmdline", "command", "filectrl", "fileindex", "filer", "help", "look", "menu",
+           "message", "mode", "process", "util", "completion", "watcher", "widget"]
 
 import os
 import sys
@@ -20,6 +20,12 @@ import keyword
 import os
 import re
 import subprocess
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from pyful import Pyful
 from pyful import completion
@@ -31,6 +37,7 @@ from pyful import util
 
 from pyful.widget.textbox import TextBox
 from pyful.widget.listbox import ListBox, Entry
+from pyful.widget.ui import Poller
 
 class Cmdline(TextBox):
     def __init__(self):
@@ -369,11 +376,14 @@ class Output(ListBox):
         ListBox.__init__(self)
         self.title = "output"
         self.cmdline = cmdline
+        self.grep = None
 
     def edit(self):
         grepoutputs = self.cursor_entry().text.split(":")
         fname = grepoutputs[0]
         lnum = grepoutputs[1]
+        if self.grep:
+            fname = util.abspath(fname, self.grep.basedir)
         try:
             process.spawn("{0} +{1} {2}".format(Pyful.environs["EDITOR"], lnum, fname))
         except Exception as e:
@@ -384,6 +394,10 @@ class Output(ListBox):
             return
         if string is None:
             string = self.cmdline.text
+        if self.grep:
+            self.grep.cancel()
+            self.grep = None
+            self.title = "output"
         cmd = util.expandmacro(string)
         out, err = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True).communicate()
         entries = []
@@ -401,9 +415,163 @@ class Output(ListBox):
         else:
             self.show([Entry("No output: `{0}'".format(cmd))])
 
+    def search(self, pattern, paths, basedir):
+        if self.grep:
+            self.grep.cancel()
+        try:
+            self.grep = GrepSearch(self, pattern, paths, basedir)
+        except re.error as e:
+            return message.exception(e)
+        self.title = "grep({0})".format(pattern)
+        self.show([])
+        self.grep.start()
+
     def terminal(self):
         pass
 
     def finish(self):
+        if self.grep:
+            self.grep.cancel()
+            self.grep = None
+        self.title = "output"
         self.hide()
         self.cmdline.history.start()
+
+class GrepSearch(object):
+    workers = 4
+    maxresults = 10000
+    blocksize = 1024 * 1024
+    linewidth = 512
+
+    def __init__(self, output, pattern, paths, basedir):
+        self.output = output
+        self.pattern = pattern
+        self.regex = re.compile(pattern.encode("utf-8"))
+        self.basedir = basedir
+        self.prefix = os.path.join(self.basedir, "")
+        self.paths = [util.abspath(path, self.basedir) for path in paths]
+        self.files = queue.Queue(maxsize=1024)
+        self.found = []
+        self.count = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        self.active = False
+
+    def start(self):
+        self.active = True
+        for i in range(max(self.workers, 1)):
+            t = threading.Thread(target=self.work)
+            t.setDaemon(True)
+            self.threads.append(t)
+            t.start()
+        t = threading.Thread(target=self.walk)
+        t.setDaemon(True)
+        t.start()
+        Poller.register(self.poll)
+
+    def cancel(self):
+        Poller.unregister(self.poll)
+        self.active = False
+
+    def walk(self):
+        stack = list(reversed(self.paths))
+        while stack and self.active:
+            path = stack.pop()
+            if not os.path.isdir(path) or os.path.islink(path):
+                self.files.put(path)
+                continue
+            try:
+                entries = sorted(util.scandir(path), key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                name = os.path.join(path, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(name)
+                    elif entry.is_file():
+                        self.files.put(name)
+                except OSError:
+                    continue
+            stack.extend(reversed(subdirs))
+        for t in self.threads:
+            self.files.put(None)
+
+    def work(self):
+        while True:
+            path = self.files.get()
+            if path is None:
+                break
+            if not self.active:
+                continue
+            try:
+                found = self.grep(path)
+            except (IOError, OSError):
+                continue
+            if found:
+                with self.lock:
+                    self.found.extend(found)
+                    self.count += len(found)
+                    if self.count >= self.maxresults:
+                        self.active = False
+
+    def grep(self, path):
+        found = []
+        lineno = 1
+        rest = b""
+        with open(path, "rb") as f:
+            while self.active:
+                block = f.read(self.blocksize)
+                if not block:
+                    break
+                if not rest and lineno == 1 and b"\0" in block[:8192]:
+                    return []
+                data = rest + block
+                end = data.rfind(b"\n") + 1
+                if not end:
+                    rest = data[-self.blocksize:]
+                    continue
+                data, rest = data[:end], data[end:]
+                if self.regex.search(data):
+                    found.extend(self.match(path, lineno, data))
+                    if len(found) >= self.maxresults:
+                        return found
+                lineno += data.count(b"\n")
+            if rest and self.active and self.regex.search(rest):
+                found.extend(self.match(path, lineno, rest))
+        return found
+
+    def match(self, path, lineno, data):
+        if path.startswith(self.prefix):
+            path = path[len(self.prefix):]
+        lines = data.split(b"\n")
+        if data.endswith(b"\n"):
+            lines.pop()
+        for line in lines:
+            if self.regex.search(line):
+                text = line[:self.linewidth].decode("utf-8", "replace")
+                text = re.sub(r"[\r]", "", text).expandtabs()
+                yield "{0}:{1}:{2}".format(path, lineno, text)
+            lineno += 1
+
+    def poll(self):
+        if self.output.grep is not self:
+            self.cancel()
+            return False
+        with self.lock:
+            found = self.found
+            self.found = []
+        found = found[:self.maxresults-len(self.output.list)]
+        self.output.list.extend(Entry(line) for line in found)
+        if [t for t in self.threads if t.is_alive()]:
+            self.output.title = "grep({0}) {1}...".format(self.pattern, len(self.output.list))
+            return True
+        if not self.output.list:
+            self.output.list.append(Entry("No match: `{0}'".format(self.pattern)))
+            self.output.title = "grep({0})".format(self.pattern)
+        elif self.count >= self.maxresults:
+            self.output.title = "grep({0}) {1} limited".format(self.pattern, len(self.output.list))
+        else:
+            self.output.title = "grep({0})".format(self.pattern)
+        return False
@@ -165,6 +165,11 @@ def _kill_thread():
     """Kill of a job threads."""
     filectrl.kill_thread()
 
+@define_command
+def _view_jobs():
+    """Display running and pending jobs."""
+    filectrl.view_jobs()
+
 @define_command
 def _drivejump():
     """Display the menu of an external disk where mount was done."""
@@ -185,6 +190,11 @@ def _drivejump():
             menu.items["Drives"].append([title, num, _wrap(f)])
     menu.show("Drives")
 
+@define_command
+def _preview():
+    """View the file under cursor in the built-in pager."""
+    widgets.filer.pager.preview(widgets.filer.file.name)
+
 @define_command
 def _fileviewer():
     """File view by tar, zipinfo, unrar, 7z and Pyful.environs["PAGER"]."""
@@ -591,7 +601,7 @@ def _toggle_sort_updir():
     filer = widgets.filer
     dircls = filer.dir.__class__
     dircls.sort_updir = not dircls.sort_updir
-    filer.workspace.all_reload()
+    filer.workspace.all_reload(force=True)
 
 @define_command
 def _toggle_draw_ext():
@@ -641,7 +651,7 @@ def _close_dir():
 @define_command
 def _all_reload():
     """Reload files of current workspace directorise."""
-    widgets.filer.workspace.all_reload()
+    widgets.filer.workspace.all_reload(force=True)
 
 @define_command
 def _swap_dir_inc():
@@ -891,6 +901,11 @@ def _globdir():
     """Invoke command line of globdir mode."""
     widgets.cmdline.start(mode.GlobDir())
 
+@define_command
+def _grep():
+    """Invoke command line of grep mode which searches in files."""
+    widgets.cmdline.start(mode.Grep())
+
 @define_command
 def _link():
     """Invoke command line of link mode."""
@@ -16,6 +16,8 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import collections
+import io
 import os
 import shutil
 import stat
@@ -25,6 +27,14 @@ import threading
 import pwd
 import grp
 import errno
+import struct
+import sys
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from pyful import message
 from pyful import util
@@ -182,28 +192,157 @@ def zipeach(src, dst, wrap=""):
 
 
 def kill_thread():
-    try:
-        thread = Filectrl.threads[0]
-    except IndexError:
+    threads = Filectrl.threads[:]
+    if not threads:
         return message.error("Thread doesn't exist.")
+    if len(threads) == 1:
+        thread = threads[0]
+    else:
+        options = [str(i+1) for i in range(len(threads))] + ["Cancel"]
+        entries = ["{0}: {1}".format(i+1, t.summary()) for i, t in enumerate(threads)]
+        ret = message.confirm("Kill which job?", options, entries)
+        if ret not in options[:-1]:
+            return
+        thread = threads[int(ret)-1]
     title = thread.title
     ret = message.confirm("Kill {0}: ".format(title), ["OK", "Cancel"])
     if ret == "OK":
         thread.kill()
 
-def _get_file_length(paths):
-    flen = dlen = 0
-    for path in paths:
-        if not os.path.lexists(path):
-            continue
-        elif os.path.islink(path) or not os.path.isdir(path):
-            flen += 1
+def view_jobs():
+    threads = Filectrl.threads[:]
+    if not threads:
+        return message.error("Thread doesn't exist.")
+    message.confirm("Jobs", ["Close"], [t.summary() for t in threads])
+
+def _get_device(path):
+    path = util.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+class TreePlanner(threading.Thread):
+    prefetch = 100000
+
+    def __init__(self, paths, progress, nbytes=True, countdirs=False, prune=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.paths = paths
+        self.progress = progress
+        self.nbytes = nbytes
+        self.countdirs = countdirs
+        self.prune = prune
+        self.queue = queue.Queue(self.prefetch)
+        self.active = True
+
+    def run(self):
+        try:
+            for path in self.paths:
+                for event in self.walk(path):
+                    if not self.active:
+                        return
+                    self.put(event)
+        finally:
+            self.progress.planned = True
+            self.put(None)
+
+    def stop(self):
+        self.active = False
+
+    def events(self, path=None):
+        if path is None:
+            source = iter(self.queue.get, None)
         else:
-            dlen += 1
-            for root, dirs, files in os.walk(path):
-                flen += len(files)
-                dlen += len(dirs)
-    return (flen, dlen)
+            # The pruned tree was planned as a single entry; its contents
+            # are planned again as they are walked.
+            self.progress.plan(nfiles=-1)
+            source = self.walk(path, prune=False)
+        for event in source:
+            if event[0] == "error":
+                message.exception(event[2])
+                continue
+            yield event
+
+    def put(self, event):
+        while self.active:
+            try:
+                return self.queue.put(event, timeout=0.1)
+            except queue.Full:
+                pass
+
+    def walk(self, root, prune=True):
+        prune = prune and self.prune
+        try:
+            st = os.lstat(root)
+        except OSError:
+            yield self.file(root, 0)
+            return
+        if not stat.S_ISDIR(st.st_mode):
+            if stat.S_ISREG(st.st_mode):
+                yield self.file(root, st.st_size)
+            else:
+                yield self.file(root, 0)
+            return
+        if prune and prune(root, root):
+            yield self.tree(root)
+            return
+        yield self.enter(root)
+        entries, error = self.scan(root)
+        if error:
+            yield ("error", root, error)
+        stack = [(root, entries)]
+        while stack and self.active:
+            path, entries = stack[-1]
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if prune and prune(root, entry.path):
+                        yield self.tree(entry.path)
+                        continue
+                    yield self.enter(entry.path)
+                    entries, error = self.scan(entry.path)
+                    if error:
+                        yield ("error", entry.path, error)
+                    stack.append((entry.path, entries))
+                    break
+                yield self.file(entry.path, self.getsize(entry))
+            else:
+                stack.pop()
+                yield ("leave", path, 0)
+
+    def scan(self, path):
+        try:
+            return (iter(list(util.scandir(path))), None)
+        except OSError as e:
+            return (iter([]), e)
+
+    def getsize(self, entry):
+        if not self.nbytes:
+            return 0
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            return 0
+        if stat.S_ISREG(st.st_mode):
+            return st.st_size
+        return 0
+
+    def enter(self, path):
+        if self.countdirs:
+            self.progress.plan(nfiles=1)
+        return ("enter", path, 0)
+
+    def tree(self, path):
+        self.progress.plan(nfiles=1)
+        return ("tree", path, 0)
+
+    def file(self, path, size):
+        self.progress.plan(size, 1)
+        return ("file", path, size)
 
 class Subloop(object):
     def __init__(self):
@@ -230,20 +369,17 @@ class Subloop(object):
                 self.draw_thread()
         self.navbar = widget.get("NavigationBar")
         self.ui = widget.ui.UI(_draw, _input)
-        self.stdscr = widget.base.StandardScreen.stdscr
+        self.ui.controller.timeout = 100
 
     def draw_thread(self):
-        try:
-            thread = Filectrl.threads[0]
-            self.navbar.draw(thread.draw)
-        except IndexError:
-            return
+        threads = [t for t in Filectrl.threads if JobScheduler.isrunning(t)]
+        threads = threads or Filectrl.threads[:]
+        if threads:
+            self.navbar.draw(threads[0].draw)
 
     def run(self):
         util.global_synchro_event.wait()
-        self.stdscr.timeout(100)
         self.ui.run()
-        self.stdscr.timeout(-1)
 
 class FilectrlCancel(Exception):
     pass
@@ -252,6 +388,7 @@ class Filectrl(object):
     threads = []
 
     def thread_loop(self, thread):
+        thread.devs = thread.devices()
         self.threads.append(thread)
         thread.start()
         if len(self.threads) > 1:
@@ -282,9 +419,8 @@ class Filectrl(object):
         for f in src:
             path = os.path.join(dst, util.unix_basename(f))
             threadlist.append(TarThread(f, path, tarmode, wrap))
-        for t in threadlist:
-            self.thread_loop(t)
-        message.puts("Finished 'tareach'")
+        title = "Tareach: mark files -> {0}".format(dst)
+        self.thread_loop(BatchThread(title, threadlist))
 
     def untar(self, src, dstdir="."):
         thread = UntarThread(src, dstdir)
@@ -303,13 +439,101 @@ class Filectrl(object):
         for f in src:
             path = os.path.join(dst, util.unix_basename(f))
             threadlist.append(ZipThread(f, path, wrap))
-        for t in threadlist:
-            self.thread_loop(t)
-        message.puts("Finished 'zipeach'")
+        title = "Zipeach: mark files -> {0}".format(dst)
+        self.thread_loop(BatchThread(title, threadlist))
+
+class JobProgress(object):
+    def __init__(self, nbytes=0, nfiles=0):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.files = 0
+        self.total_bytes = nbytes
+        self.total_files = nfiles
+        self.planned = True
+        self.notice = ""
+
+    def note(self, notice):
+        self.notice = notice
+
+    def add(self, nbytes=0, nfiles=0):
+        with self.lock:
+            self.bytes += nbytes
+            self.files += nfiles
 
-class JobThread(threading.Thread):
-    lock = threading.Lock()
+    def plan(self, nbytes=0, nfiles=0):
+        with self.lock:
+            self.total_bytes += nbytes
+            self.total_files += nfiles
+
+    def sample(self):
+        with self.lock:
+            return (self.bytes, self.files)
+
+    def measure(self):
+        with self.lock:
+            if self.total_bytes:
+                return (self.bytes, self.total_bytes)
+            return (self.files, self.total_files)
+
+    def countfiles(self):
+        return not self.total_bytes
+
+    def goal(self):
+        if self.planned:
+            return str(self.total_files)
+        return "{0}+".format(self.total_files)
+
+class JobScheduler(object):
+    workers = 4
+    device_limit = 1
+    cond = threading.Condition()
+    pending = []
+    running = {}
+
+    @classmethod
+    def acquire(cls, job):
+        with cls.cond:
+            cls.pending.append(job)
+            try:
+                while job.active and not cls.runnable(job):
+                    cls.cond.wait()
+            finally:
+                cls.pending.remove(job)
+                cls.cond.notify_all()
+            if job.active:
+                cls.running[job] = job.devs
+            return job.active
+
+    @classmethod
+    def release(cls, job):
+        with cls.cond:
+            cls.running.pop(job, None)
+            cls.cond.notify_all()
+
+    @classmethod
+    def wake(cls):
+        with cls.cond:
+            cls.cond.notify_all()
+
+    @classmethod
+    def runnable(cls, job):
+        if len(cls.running) >= cls.workers:
+            return False
+        for dev in job.devs:
+            if len([d for d in cls.running.values() if dev in d]) >= cls.device_limit:
+                return False
+        for other in cls.pending:
+            if other is job:
+                break
+            if other.active and other.devs & job.devs:
+                return False
+        return True
+
+    @classmethod
+    def isrunning(cls, job):
+        return job in cls.running
 
+class JobThread(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
         self.setDaemon(True)
@@ -317,39 +541,457 @@ class JobThread(threading.Thread):
         self.title = self.__class__.__name__
         self.navbar = widget.get("NavigationBar")
         self.status = ""
+        self.progress = None
+        self.gauge = None
+        self.devs = set()
 
     def main(self):
         pass
 
     def run(self):
-        with self.lock:
+        try:
+            if not JobScheduler.acquire(self):
+                raise FilectrlCancel(self.title)
             try:
                 self.main()
                 message.puts("Finished: {0}".format(self.title))
-            except FilectrlCancel as e:
-                message.exception(e)
             finally:
-                Filectrl.threads.remove(self)
+                JobScheduler.release(self)
+        except FilectrlCancel as e:
+            message.exception(e)
+        finally:
+            Filectrl.threads.remove(self)
 
     def kill(self):
         self.update("Waiting...")
         self.active = False
+        JobScheduler.wake()
+
+    def paths(self):
+        paths = []
+        for name in ("src", "dst", "dstdir", "path"):
+            value = getattr(self, name, None)
+            if isinstance(value, list):
+                paths.extend(value)
+            elif value:
+                paths.append(value)
+        return paths
+
+    def devices(self):
+        devs = set()
+        for path in self.paths():
+            dev = _get_device(path)
+            if dev is not None:
+                devs.add(dev)
+        return devs
+
+    def plan(self, paths, nbytes=True, countdirs=False, prune=None):
+        self.progress = JobProgress()
+        self.progress.planned = False
+        planner = TreePlanner(paths, self.progress, nbytes, countdirs, prune)
+        planner.start()
+        return planner
+
+    def summary(self):
+        if JobScheduler.isrunning(self):
+            text = "Running: {0}".format(self.title)
+        else:
+            text = "Pending: {0}".format(self.title)
+        if self.progress is not None:
+            nfiles = self.progress.sample()[1]
+            done, total = self.progress.measure()
+            text += " ({0}/{1} files".format(nfiles, self.progress.goal())
+            if total:
+                text += ", {0}%".format(done * 100 // total)
+            text += ")"
+            if self.progress.notice:
+                text += " {0}".format(self.progress.notice)
+        return text
 
     def draw(self, navbar):
+        y, x = navbar.getmaxyx()
         navbar.move(0, 1)
         navbar.clrtoeol()
-        navbar.addstr(self.status, curses.A_BOLD)
+        navbar.addstr(util.mbs_ljust(self.status, x-2), curses.A_BOLD)
+        if self.progress is not None:
+            done, total = self.progress.measure()
+            if self.gauge is None:
+                self.gauge = ProgressGauge(total or 1)
+            self.gauge.maxval = float(total or 1)
+            self.gauge.countfiles = self.progress.countfiles()
+            self.gauge.update(done)
+            self.gauge.draw(navbar, 1, 1)
         navbar.noutrefresh()
 
     def update(self, status):
         self.status = status
 
     def notify(self, notice):
-        message.puts(notice)
+        # Per-file notices are kept for the job list instead of going to
+        # the message box, which starts a timer for every line.
+        if self.progress is not None:
+            self.progress.note(notice)
+
+try:
+    zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, 8, 0, b"\0")
+    _zdict_support = True
+except TypeError:
+    _zdict_support = False
+
+_deflate_end = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+
+def _deflate_block(data, zdict, level):
+    if zdict and _zdict_support:
+        c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 8, 0, zdict)
+    else:
+        c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+
+class CompressTask(object):
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class CompressWorker(threading.Thread):
+    def __init__(self, tasks):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.tasks = tasks
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            task.run()
+
+class CompressPool(object):
+    def __init__(self, workers):
+        self.tasks = queue.Queue()
+        self.workers = [CompressWorker(self.tasks) for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, func, *args):
+        task = CompressTask(func, args)
+        self.tasks.put(task)
+        return task
+
+    def close(self):
+        for worker in self.workers:
+            self.tasks.put(None)
+
+class ParallelGzipFile(object):
+    blocksize = 128*1024
+    level = 9
+
+    def __init__(self, fileobj, workers):
+        self.fileobj = fileobj
+        self.pool = CompressPool(workers)
+        self.window = workers * 4
+        self.pending = collections.deque()
+        self.buf = []
+        self.buflen = 0
+        self.zdict = None
+        self.crc = 0
+        self.size = 0
+        self.fileobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<L", int(time.time())) + b"\x02\xff")
+
+    def write(self, data):
+        self.buf.append(bytes(data))
+        self.buflen += len(data)
+        if self.buflen >= self.blocksize:
+            self.submit()
+        return len(data)
+
+    def submit(self):
+        data = b"".join(self.buf)
+        self.buf = []
+        self.buflen = 0
+        if not data:
+            return
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.pending.append(self.pool.submit(_deflate_block, data, self.zdict, self.level))
+        self.zdict = data[-32768:]
+        self.drain(self.window)
+
+    def drain(self, limit=0):
+        while len(self.pending) > limit:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        try:
+            self.submit()
+            self.drain()
+            self.fileobj.write(_deflate_end)
+            self.fileobj.write(struct.pack("<LL", self.crc & 0xffffffff, self.size & 0xffffffff))
+        finally:
+            self.pool.close()
+            self.fileobj.close()
+
+class ParallelZipWriter(object):
+    blocksize = 128*1024
+    level = 6
+
+    def __init__(self, myzip, workers, callback):
+        self.myzip = myzip
+        self.pool = CompressPool(workers)
+        self.window = workers * 4
+        self.callback = callback
+        self.pending = collections.deque()
+        self.blocks = 0
+        self.dest = None
+        self.zip64 = False
+
+    @classmethod
+    def usable(cls, myzip):
+        # Members are written around ZipFile, the way ZipFile.write does
+        # it for a seekable file, so any zipfile missing one of the
+        # pieces that relies on falls back to the serial writer.
+        import zipfile
+        if sys.version_info < (3, 6):
+            return False
+        if not (hasattr(zipfile.ZipInfo, "from_file") and hasattr(zipfile.ZipInfo, "FileHeader")):
+            return False
+        for name in ("fp", "start_dir", "filelist", "NameToInfo"):
+            if not hasattr(myzip, name):
+                return False
+        try:
+            return myzip.fp.seekable()
+        except (AttributeError, ValueError):
+            return False
+
+    def deflate(self, path, zipname, arcname):
+        import zipfile
+        zinfo = zipfile.ZipInfo.from_file(path, zipname)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        self.pending.append(("open", zinfo, arcname))
+        zdict = None
+        crc = size = 0
+        with io.open(path, "rb") as f:
+            while True:
+                data = f.read(self.blocksize)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                task = self.pool.submit(_deflate_block, data, zdict, self.level)
+                self.pending.append(("block", task))
+                self.blocks += 1
+                zdict = data[-32768:]
+                self.drain(self.window)
+        self.pending.append(("close", zinfo, arcname, crc & 0xffffffff, size))
+
+    def write(self, callback, size, arcname):
+        self.pending.append(("write", callback, arcname, size))
+        self.drain(self.window)
+
+    def begin(self, zinfo):
+        import zipfile
+        zinfo.flag_bits = 0
+        zinfo.CRC = zinfo.compress_size = 0
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16
+        self.zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        fp = self.myzip.fp
+        fp.seek(self.myzip.start_dir)
+        zinfo.header_offset = fp.tell()
+        fp.write(zinfo.FileHeader(self.zip64))
+        self.dest = zinfo
+
+    def end(self, crc, size):
+        import zipfile
+        zinfo = self.dest
+        self.dest = None
+        fp = self.myzip.fp
+        fp.write(_deflate_end)
+        zinfo.compress_size += len(_deflate_end)
+        zinfo.CRC = crc
+        zinfo.file_size = size
+        if not self.zip64 and max(size, zinfo.compress_size) > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+        end = fp.tell()
+        fp.seek(zinfo.header_offset)
+        fp.write(zinfo.FileHeader(self.zip64))
+        fp.seek(end)
+        self.myzip.start_dir = end
+        self.myzip.filelist.append(zinfo)
+        self.myzip.NameToInfo[zinfo.filename] = zinfo
+
+    def drain(self, limit=0):
+        while self.pending and (self.blocks > limit or not limit):
+            item = self.pending.popleft()
+            if item[0] == "open":
+                self.begin(item[1])
+            elif item[0] == "block":
+                self.blocks -= 1
+                data = item[1].result()
+                self.myzip.fp.write(data)
+                self.dest.compress_size += len(data)
+            elif item[0] == "close":
+                self.end(item[3], item[4])
+                self.callback(item[2], item[1].file_size)
+            else:
+                item[1]()
+                self.callback(item[2], item[3])
+
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            self.pool.close()
+
+class BatchProgress(object):
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def progresses(self):
+        return [job.progress for job in self.jobs if job.progress is not None]
+
+    @property
+    def notice(self):
+        for progress in reversed(self.progresses()):
+            if progress.notice:
+                return progress.notice
+        return ""
+
+    def sample(self):
+        nbytes = nfiles = 0
+        for progress in self.progresses():
+            b, f = progress.sample()
+            nbytes += b
+            nfiles += f
+        return (nbytes, nfiles)
+
+    def measure(self):
+        progresses = self.progresses()
+        nbytes, nfiles = self.sample()
+        total_bytes = sum(p.total_bytes for p in progresses)
+        if total_bytes:
+            return (nbytes, total_bytes)
+        return (nfiles, sum(p.total_files for p in progresses))
+
+    def countfiles(self):
+        return not any(p.total_bytes for p in self.progresses())
+
+    def goal(self):
+        progresses = self.progresses()
+        total = sum(p.total_files for p in progresses)
+        if len(progresses) < len(self.jobs) or not all(p.planned for p in progresses):
+            return "{0}+".format(total)
+        return str(total)
+
+class BatchThread(JobThread):
+    workers = 4
+
+    def __init__(self, title, jobs):
+        JobThread.__init__(self)
+        self.title = title
+        self.jobs = jobs
+        self.progress = BatchProgress(jobs)
+        self.lock = threading.Lock()
+        self.running = []
+        self.results = []
+
+    def paths(self):
+        paths = []
+        for job in self.jobs:
+            paths.extend(job.paths())
+        return paths
+
+    def main(self):
+        tasks = queue.Queue()
+        for job in self.jobs:
+            tasks.put(job)
+        workers = [BatchWorker(self, tasks) for i in range(min(self.workers, len(self.jobs)))]
+        for worker in workers:
+            tasks.put(None)
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.report()
+        if not self.active:
+            raise FilectrlCancel(self.title)
+
+    def runjob(self, job):
+        with self.lock:
+            self.running.append(job)
+        try:
+            job.main()
+            result = None
+        except Exception as e:
+            result = e
+        with self.lock:
+            self.running.remove(job)
+            self.results.append((job, result))
+
+    def report(self):
+        failed = 0
+        for job, e in self.results:
+            if e is None:
+                message.puts("Finished: {0}".format(job.title))
+            else:
+                failed += 1
+                message.error("Failed: {0}: {1}".format(job.title, e))
+        skipped = len(self.jobs) - len(self.results)
+        text = "{0}: {1} succeeded, {2} failed".format(self.title, len(self.results)-failed, failed)
+        if skipped:
+            text += ", {0} skipped".format(skipped)
+        if failed or skipped:
+            message.error(text)
+        else:
+            message.puts(text)
+
+    def kill(self):
+        JobThread.kill(self)
+        for job in self.jobs:
+            job.active = False
+
+    def draw(self, navbar):
+        if self.active:
+            with self.lock:
+                running = [job.status for job in self.running]
+                done = len(self.results)
+            self.status = "({0}/{1}) {2}".format(done, len(self.jobs), " | ".join(running))
+        JobThread.draw(self, navbar)
+
+class BatchWorker(threading.Thread):
+    def __init__(self, batch, tasks):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.batch = batch
+        self.tasks = tasks
+
+    def run(self):
+        while True:
+            job = self.tasks.get()
+            if job is None:
+                break
+            if self.batch.active:
+                self.batch.runjob(job)
 
 class TarThread(JobThread):
     tarmodes = {"tar": "", "gzip": "gz", "bzip2": "bz2"}
     tarexts = {"tar": ".tar", "gzip": ".tgz", "bzip2": ".bz2"}
+    workers = 4
 
     def __init__(self, src, dst, tarmode="gzip", wrap=""):
         JobThread.__init__(self)
@@ -375,25 +1017,40 @@ class TarThread(JobThread):
             self.dst = self.dst.encode()
         except:
             pass
+        gzfile = None
         try:
             import tarfile
             mode = self.tarmodes[self.tarmode]
-            tar = tarfile.open(self.dst, "w|"+mode)
+            if mode == "gz" and self.workers > 1:
+                gzfile = ParallelGzipFile(io.open(self.dst, "wb"), self.workers)
+                tar = tarfile.open(self.dst, "w|", gzfile)
+            else:
+                tar = tarfile.open(self.dst, "w|"+mode)
         except Exception as e:
-            return message.exception(e)
+            if gzfile:
+                gzfile.close()
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while `tar'")
+        planner = self.plan(self.src, countdirs=True)
         try:
-            goal = sum(_get_file_length(self.src))
             elapse = 1
-            for path in self.src:
-                for f in self.generate(path):
-                    arcname = f.replace(os.path.commonprefix([f, self.src_dirname]), "")
-                    msg = "({0}/{1}): {2}".format(elapse, goal, arcname)
-                    self.update("Adding{0}".format(msg))
-                    self.add_file(tar, f, arcname)
-                    self.notify("Added{0}".format(msg))
-                    elapse += 1
+            for event, f, size in planner.events():
+                if event == "leave":
+                    continue
+                arcname = f.replace(os.path.commonprefix([f, self.src_dirname]), "")
+                msg = "({0}/{1}): {2}".format(elapse, self.progress.goal(), arcname)
+                self.update("Adding{0}".format(msg))
+                self.add_file(tar, f, arcname)
+                self.notify("Added{0}".format(msg))
+                self.progress.add(size, 1)
+                elapse += 1
         finally:
-            tar.close()
+            planner.stop()
+            try:
+                tar.close()
+            finally:
+                if gzfile:
+                    gzfile.close()
         try:
             if len(self.src) == 1:
                 lst = os.lstat(self.src[0])
@@ -410,15 +1067,6 @@ class TarThread(JobThread):
         if not self.active:
             raise FilectrlCancel(self.title)
 
-    def generate(self, path):
-        if os.path.isdir(path):
-            yield path
-            for sub in os.listdir(path):
-                for f in self.generate(os.path.join(path, sub)):
-                    yield f
-        else:
-            yield path
-
 class UntarThread(JobThread):
     tarmodes = {".tar": "", ".tgz": "gz", ".gz": "gz", ".bz2": "bz2",}
 
@@ -439,7 +1087,8 @@ class UntarThread(JobThread):
             try:
                 os.makedirs(self.dstdir)
             except OSError as e:
-                return message.exception(e)
+                message.exception(e)
+                raise FilectrlCancel("Exception occurred while `untar'")
         for tarpath in self.src:
             self.extract(tarpath)
 
@@ -447,27 +1096,35 @@ class UntarThread(JobThread):
         mode = self.tarmodes.get(util.extname(source), "gz")
         try:
             import tarfile
-            tar = tarfile.open(source, "r:"+mode)
+            tar = tarfile.open(source, "r|"+mode)
         except Exception as e:
             message.exception(e)
             raise FilectrlCancel("Exception occurred while `untar'")
         try:
-            for info in tar.getmembers():
+            for info in tar:
                 if not self.active:
                     raise FilectrlCancel(self.title)
                 self.update("Extracting: {0}".format(info.name))
                 tar.extract(info, self.dstdir)
                 self.notify("Extracted: {0}".format(info.name))
                 if info.isdir():
-                    self.dirlist.append(info)
+                    self.dirlist.append((info.name, info.mtime))
+                # Earlier members are already on disk, where hard links
+                # find their targets, so nothing needs to be kept.
+                tar.members = []
         finally:
-            for dinfo in reversed(sorted(self.dirlist, key=lambda a: a.name)):
-                dirpath = os.path.join(self.dstdir, dinfo.name)
-                os.utime(dirpath, (dinfo.mtime, dinfo.mtime))
+            for name, mtime in reversed(sorted(self.dirlist)):
+                dirpath = os.path.join(self.dstdir, name)
+                try:
+                    os.utime(dirpath, (mtime, mtime))
+                except OSError as e:
+                    message.exception(e)
             self.dirlist[:] = []
             tar.close()
 
 class UnzipThread(JobThread):
+    workers = 4
+
     def __init__(self, src, dstdir):
         JobThread.__init__(self)
         if isinstance(src, list):
@@ -478,6 +1135,7 @@ class UnzipThread(JobThread):
             self.src = [util.abspath(src)]
         self.dstdir = util.abspath(dstdir)
         self.dirlist = []
+        self.errors = []
 
     def main(self):
         self.update("Reading...")
@@ -485,7 +1143,8 @@ class UnzipThread(JobThread):
             try:
                 os.makedirs(self.dstdir)
             except OSError as e:
-                return message.exception(e)
+                message.exception(e)
+                raise FilectrlCancel("Exception occurred while `unzip'")
         for zippath in self.src:
             self.extract(zippath)
 
@@ -494,9 +1153,15 @@ class UnzipThread(JobThread):
             import zipfile
             myzip = zipfile.ZipFile(zippath, "r")
         except Exception as e:
-            return message.exception(e)
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while `unzip'")
         try:
-            for info in myzip.infolist():
+            infolist = myzip.infolist()
+            self.progress = JobProgress(sum(i.file_size for i in infolist), len(infolist))
+            names = set(i.filename for i in infolist)
+            if self.workers > 1 and len(names) == len(infolist):
+                return self.extract_parallel(zippath, myzip, infolist)
+            for info in infolist:
                 if not self.active:
                     raise FilectrlCancel(self.title)
                 try:
@@ -504,6 +1169,7 @@ class UnzipThread(JobThread):
                 except Exception as e:
                     message.exception(e)
                     raise FilectrlCancel("Exception occurred while `unzip'")
+                self.progress.add(info.file_size, 1)
         finally:
             for d in reversed(sorted(self.dirlist)):
                 self.copy_external_attr(myzip, d)
@@ -516,34 +1182,61 @@ class UnzipThread(JobThread):
         path = os.path.join(self.dstdir, ufname)
 
         if stat.S_ISDIR(zipinfo.external_attr >> 16):
-            dirpath = os.path.join(self.dstdir, ufname)
-            if not os.path.exists(dirpath):
-                os.makedirs(dirpath)
+            _makedirs(os.path.join(self.dstdir, ufname))
             self.dirlist.append(fname)
         else:
-            dirpath = os.path.join(self.dstdir, util.unix_dirname(ufname))
-            if not os.path.exists(dirpath):
-                os.makedirs(dirpath)
+            _makedirs(os.path.join(self.dstdir, util.unix_dirname(ufname)))
             source = myzip.open(fname)
             try:
                 target = open(path, "wb")
                 self.update("Inflating: {0}".format(ufname))
-                shutil.copyfileobj(source, target)
+                shutil.copyfileobj(source, target, FileJob.bufsize)
                 self.notify("Inflated: {0}".format(ufname))
                 source.close()
                 target.close()
                 self.copy_external_attr(myzip, fname)
             except IOError as e:
-                if e[0] == errno.EISDIR:
+                if e.errno == errno.EISDIR:
                     self.dirlist.append(fname)
 
+    def extract_parallel(self, zippath, myzip, infolist):
+        tasks = queue.Queue()
+        dirs = set()
+        for info in infolist:
+            if stat.S_ISDIR(info.external_attr >> 16) or info.filename.endswith("/"):
+                self.extract_file(myzip, info)
+                self.progress.add(nfiles=1)
+            else:
+                dirpath = util.unix_dirname(util.force_decode(info.filename))
+                if dirpath not in dirs:
+                    dirs.add(dirpath)
+                    try:
+                        _makedirs(os.path.join(self.dstdir, dirpath))
+                    except OSError as e:
+                        message.exception(e)
+                        raise FilectrlCancel("Exception occurred while `unzip'")
+                tasks.put(info)
+        self.errors = []
+        workers = [UnzipWorker(self, zippath, tasks)
+                   for i in range(min(self.workers, tasks.qsize()))]
+        for worker in workers:
+            tasks.put(None)
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if self.errors:
+            message.exception(self.errors[0])
+            raise FilectrlCancel("Exception occurred while `unzip'")
+        if not self.active:
+            raise FilectrlCancel(self.title)
+
     def copy_external_attr(self, myzip, path):
         try:
             info = myzip.getinfo(path)
         except Exception as e:
             return message.exception(e)
         perm = info.external_attr >> 16
-        date = list(info.date_time) + [-1, -1, -1]
+        date = tuple(info.date_time) + (-1, -1, -1)
         path = util.force_decode(path)
         abspath = os.path.join(self.dstdir, path)
         try:
@@ -554,7 +1247,37 @@ class UnzipThread(JobThread):
         except Exception as e:
             message.exception(e)
 
+class UnzipWorker(threading.Thread):
+    def __init__(self, thread, zippath, tasks):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.thread = thread
+        self.zippath = zippath
+        self.tasks = tasks
+
+    def run(self):
+        thread = self.thread
+        myzip = None
+        while True:
+            info = self.tasks.get()
+            if info is None:
+                break
+            if not thread.active or thread.errors:
+                continue
+            try:
+                if myzip is None:
+                    import zipfile
+                    myzip = zipfile.ZipFile(self.zippath, "r")
+                thread.extract_file(myzip, info)
+                thread.progress.add(info.file_size, 1)
+            except Exception as e:
+                thread.errors.append(e)
+        if myzip is not None:
+            myzip.close()
+
 class ZipThread(JobThread):
+    workers = 4
+
     def __init__(self, src, dst, wrap=""):
         JobThread.__init__(self)
         if not dst.endswith(".zip"):
@@ -577,19 +1300,34 @@ class ZipThread(JobThread):
             import zipfile
             myzip = zipfile.ZipFile(self.dst, mode, compression=zipfile.ZIP_DEFLATED)
         except Exception as e:
-            return message.exception(e)
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while `zip'")
+        pipeline = None
+        if self.workers > 1 and mode == "w" and ParallelZipWriter.usable(myzip):
+            pipeline = ParallelZipWriter(myzip, self.workers, self.added)
+        planner = self.plan(self.src, countdirs=True)
         try:
-            goal = sum(_get_file_length(self.src))
             elapse = 1
-            for path in self.src:
-                for f in self.generate(path):
-                    arcname = f.replace(os.path.commonprefix([f, self.src_dirname]), "")
-                    msg = "({0}/{1}): {2}".format(elapse, goal, arcname)
-                    self.update("Adding{0}".format(msg))
+            for event, f, size in planner.events():
+                if event == "leave":
+                    continue
+                arcname = f.replace(os.path.commonprefix([f, self.src_dirname]), "")
+                msg = "({0}/{1}): {2}".format(elapse, self.progress.goal(), arcname)
+                self.update("Adding{0}".format(msg))
+                if pipeline is None:
                     self.write_file(myzip, f, arcname)
                     self.notify("Added{0}".format(msg))
-                    elapse += 1
+                    self.progress.add(size, 1)
+                elif event == "file" and os.path.isfile(f):
+                    self.deflate_file(pipeline, f, arcname)
+                else:
+                    write = lambda f=f, arcname=arcname: self.write_file(myzip, f, arcname)
+                    pipeline.write(write, size, arcname)
+                elapse += 1
         finally:
+            planner.stop()
+            if pipeline:
+                pipeline.close()
             myzip.close()
 
         if len(self.src) == 1:
@@ -621,16 +1359,23 @@ class ZipThread(JobThread):
         if not self.active:
             raise FilectrlCancel(self.title)
 
-    def generate(self, path):
-        if os.path.isdir(path):
-            yield path
-            for sub in os.listdir(path):
-                for f in self.generate(os.path.join(path, sub)):
-                    yield f
-        else:
-            yield path
+    def deflate_file(self, pipeline, source, arcname):
+        try:
+            pipeline.deflate(source, os.path.join(self.wrap, arcname), arcname)
+        except Exception as e:
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while `zip'")
+        if not self.active:
+            raise FilectrlCancel(self.title)
+
+    def added(self, arcname, size):
+        nfiles = self.progress.sample()[1]
+        self.notify("Added({0}/{1}): {2}".format(nfiles+1, self.progress.goal(), arcname))
+        self.progress.add(size, 1)
 
 class DeleteThread(JobThread):
+    workers = 4
+
     def __init__(self, path):
         JobThread.__init__(self)
         if isinstance(path, list):
@@ -643,15 +1388,24 @@ class DeleteThread(JobThread):
 
     def main(self):
         self.update("Delete starting...")
-        goal = _get_file_length(self.path)[0]
-        elapse = 1
-        for path in self.path:
-            for f in self.generate(path):
-                msg = "({0}/{1}): {2}".format(elapse, goal, util.unix_basename(f))
+        if _dir_fd_support:
+            return self.fast_delete()
+        planner = self.plan(self.path, nbytes=False)
+        try:
+            elapse = 1
+            for event, f, size in planner.events():
+                if event == "leave":
+                    self.delete_dir(f)
+                if event != "file":
+                    continue
+                msg = "({0}/{1}): {2}".format(elapse, self.progress.goal(), util.unix_basename(f))
                 self.update("Deleting{0}".format(msg))
                 self.delete_file(f)
                 self.notify("Deleted{0}".format(msg))
+                self.progress.add(nfiles=1)
                 elapse += 1
+        finally:
+            planner.stop()
 
     def delete_file(self, f):
         try:
@@ -665,21 +1419,158 @@ class DeleteThread(JobThread):
     def delete_dir(self, directory):
         try:
             os.rmdir(directory)
-        except Exception as e:
-            if e[0] != errno.ENOTEMPTY:
+        except OSError as e:
+            if e.errno != errno.ENOTEMPTY:
                 message.exception(e)
                 raise FilectrlCancel("Exception occurred while directory deleting")
 
-    def generate(self, path):
-        if os.path.islink(path) or not os.path.isdir(path):
-            yield path
-        else:
-            for sub in os.listdir(path):
-                for f in self.generate(os.path.join(path, sub)):
-                    yield f
-            self.delete_dir(path)
+    def fast_delete(self):
+        self.progress = JobProgress()
+        self.progress.planned = False
+        try:
+            for path in self.path:
+                self.update("Deleting: {0}".format(path))
+                if os.path.isdir(path) and not os.path.islink(path):
+                    self.delete_tree(path)
+                else:
+                    self.progress.plan(nfiles=1)
+                    self.delete_file(path)
+                    self.progress.add(nfiles=1)
+                self.notify("Deleted: {0}".format(path))
+        finally:
+            self.progress.planned = True
+
+    def delete_tree(self, path):
+        parent, name = os.path.split(path)
+        try:
+            parentfd = os.open(parent, os.O_RDONLY)
+        except OSError as e:
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while deleting")
+        try:
+            if self.workers > 1:
+                self.delete_parallel(parentfd, name, path)
+            else:
+                self.deleteat(parentfd, name, path)
+        finally:
+            os.close(parentfd)
+
+    def delete_parallel(self, parentfd, name, path):
+        fd = self.opendir(parentfd, name, path)
+        try:
+            subdirs = self.unlinkfiles(fd, path)
+            jobs = queue.Queue()
+            for sub in subdirs:
+                jobs.put(sub)
+            workers = [DeleteWorker(self, fd, path, jobs)
+                       for i in range(min(self.workers, len(subdirs)))]
+            for worker in workers:
+                jobs.put(None)
+                worker.start()
+            errors = []
+            for worker in workers:
+                worker.join()
+                errors.extend(worker.errors)
+        finally:
+            os.close(fd)
+        if errors:
+            raise errors[0]
+        self.rmdirat(parentfd, name, path)
+
+    def deleteat(self, parentfd, name, path):
+        fd = self.opendir(parentfd, name, path)
+        stack = [(parentfd, name, path, fd, iter(self.unlinkfiles(fd, path)))]
+        try:
+            while stack:
+                parentfd, name, path, fd, subdirs = stack[-1]
+                for sub in subdirs:
+                    subpath = os.path.join(path, sub)
+                    subfd = self.opendir(fd, sub, subpath)
+                    stack.append((fd, sub, subpath, subfd, iter(self.unlinkfiles(subfd, subpath))))
+                    break
+                else:
+                    stack.pop()
+                    os.close(fd)
+                    self.rmdirat(parentfd, name, path)
+        finally:
+            for frame in stack:
+                os.close(frame[3])
+
+    def opendir(self, dirfd, name, path):
+        try:
+            return os.open(name, os.O_RDONLY | _O_DIRECTORY | _O_NOFOLLOW, dir_fd=dirfd)
+        except OSError as e:
+            e.filename = path
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while deleting")
+
+    def unlinkfiles(self, fd, path):
+        subdirs = []
+        files = []
+        try:
+            for entry in os.scandir(fd):
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+        except OSError as e:
+            e.filename = path
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while deleting")
+        self.progress.plan(nfiles=len(files))
+        for name in files:
+            if not self.active:
+                raise FilectrlCancel(self.title)
+            try:
+                os.unlink(name, dir_fd=fd)
+            except OSError as e:
+                e.filename = os.path.join(path, name)
+                message.exception(e)
+                raise FilectrlCancel("Exception occurred while deleting")
+            self.progress.add(nfiles=1)
+        if files:
+            nfiles = self.progress.sample()[1]
+            self.update("Deleting({0}/{1}): {2}".format(nfiles, self.progress.goal(), path))
+        return subdirs
+
+    def rmdirat(self, dirfd, name, path):
+        try:
+            os.rmdir(name, dir_fd=dirfd)
+        except OSError as e:
+            e.filename = path
+            message.exception(e)
+            raise FilectrlCancel("Exception occurred while directory deleting")
+
+class DeleteWorker(threading.Thread):
+    def __init__(self, thread, dirfd, path, jobs):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.thread = thread
+        self.dirfd = dirfd
+        self.path = path
+        self.jobs = jobs
+        self.errors = []
+
+    def run(self):
+        while True:
+            name = self.jobs.get()
+            if name is None:
+                break
+            path = os.path.join(self.path, name)
+            try:
+                self.thread.deleteat(self.dirfd, name, path)
+            except FilectrlCancel as e:
+                self.errors.append(e)
+                break
+            except Exception as e:
+                message.exception(e)
+                self.errors.append(FilectrlCancel("Exception occurred while deleting"))
+                break
 
 class CopyThread(JobThread):
+    workers = 4
+    maxerrors = 10
+
     def __init__(self, src, dst):
         JobThread.__init__(self)
         self.dst = util.abspath(dst)
@@ -695,20 +1586,105 @@ class CopyThread(JobThread):
 
     def main(self):
         self.update("Copy starting...")
-        goal = _get_file_length(self.src)[0]
-        fjg = FileJobGenerator()
-        elapse = 1
+        planner = self.plan(self.src)
+        try:
+            if self.workers > 1:
+                return self.parallel_copy(planner)
+            fjg = FileJobGenerator()
+            elapse = 1
+            mark = len(self.src) - 1
+            for f in self.src:
+                for job in fjg.generate(f, self.dst, False, mark, planner):
+                    if not self.active:
+                        raise FilectrlCancel(self.title)
+                    if job:
+                        msg = "({0}/{1}): {2}".format(elapse, self.progress.goal(), util.unix_basename(job.src))
+                        self.update("Copying{0}".format(msg))
+                        job.copy(self.progress)
+                        self.notify("Copied{0}".format(msg))
+                    self.progress.add(nfiles=1)
+                    elapse += 1
+        finally:
+            planner.stop()
+
+    def parallel_copy(self, planner):
+        fjg = FileJobGenerator(defer=True)
+        pool = CopyPool(self, self.workers)
         mark = len(self.src) - 1
-        for f in self.src:
-            for job in fjg.generate(f, self.dst, False, mark):
-                if not self.active:
-                    raise FilectrlCancel(self.title)
-                if job:
-                    msg = "({0}/{1}): {2}".format(elapse, goal, util.unix_basename(job.src))
-                    self.update("Copying{0}".format(msg))
-                    job.copy()
-                    self.notify("Copied{0}".format(msg))
-                elapse += 1
+        try:
+            for f in self.src:
+                for job in fjg.generate(f, self.dst, False, mark, planner):
+                    if not self.active:
+                        raise FilectrlCancel(self.title)
+                    if job:
+                        pool.put(job)
+                    else:
+                        self.progress.add(nfiles=1)
+        except Exception:
+            pool.cancel()
+            raise
+        finally:
+            pool.join()
+        if not self.active:
+            raise FilectrlCancel(self.title)
+        fjg.copydirs()
+        if pool.errors:
+            for src, e in pool.errors[:self.maxerrors]:
+                message.error("{0}: {1}: {2}".format(e.__class__.__name__, src, e))
+            message.error("{0}: {1} of {2} files failed".format(self.title, len(pool.errors), self.progress.goal()))
+
+class CopyPool(object):
+    def __init__(self, thread, workers):
+        self.thread = thread
+        self.jobs = queue.Queue(workers*2)
+        self.errors = []
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.workers = [CopyWorker(self) for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def put(self, job):
+        self.jobs.put(job)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def join(self):
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def failed(self, job, e):
+        with self.lock:
+            self.errors.append((job.src, e))
+
+class CopyWorker(threading.Thread):
+    def __init__(self, pool):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.pool = pool
+
+    def run(self):
+        thread = self.pool.thread
+        progress = thread.progress
+        while True:
+            job = self.pool.jobs.get()
+            if job is None:
+                break
+            if not thread.active or self.pool.cancelled:
+                continue
+            nbytes, nfiles = progress.sample()
+            msg = "({0}/{1}): {2}".format(nfiles+1, progress.goal(), util.unix_basename(job.src))
+            thread.update("Copying{0}".format(msg))
+            try:
+                job.transfer(progress)
+                thread.notify("Copied{0}".format(msg))
+            except Exception as e:
+                self.pool.failed(job, e)
+                progress.add(max(job.size - job.done, 0))
+            progress.add(nfiles=1)
 
 class MoveThread(JobThread):
     def __init__(self, src, dst):
@@ -723,65 +1699,130 @@ class MoveThread(JobThread):
             src = util.abspath(src)
             self.title = "Move: {0} -> {1}".format(src, self.dst)
             self.src = [src]
+        self.targets = {}
 
     def main(self):
         self.update("Move starting...")
-        goal = _get_file_length(self.src)[0]
-        fjg = FileJobGenerator()
-        elapse = 1
-        mark = len(self.src) - 1
-        for f in self.src:
-            for job in fjg.generate(f, self.dst, True, mark):
-                if not self.active:
-                    raise FilectrlCancel(self.title)
-                if job:
-                    msg = "({0}/{1}): {2}".format(elapse, goal, util.unix_basename(job.src))
-                    self.update("Moving{0}".format(msg))
-                    job.move()
-                    self.notify("Moved{0}".format(msg))
-                elapse += 1
+        planner = self.plan(self.src, prune=self.renamable)
+        try:
+            fjg = FileJobGenerator()
+            elapse = 1
+            mark = len(self.src) - 1
+            for f in self.src:
+                for job in fjg.generate(f, self.dst, True, mark, planner):
+                    if not self.active:
+                        raise FilectrlCancel(self.title)
+                    if job:
+                        msg = "({0}/{1}): {2}".format(elapse, self.progress.goal(), util.unix_basename(job.src))
+                        self.update("Moving{0}".format(msg))
+                        job.move(self.progress)
+                        self.notify("Moved{0}".format(msg))
+                    self.progress.add(nfiles=1)
+                    elapse += 1
+        finally:
+            planner.stop()
+
+    def renamable(self, root, path):
+        if root not in self.targets:
+            self.targets[root] = self.probe(root)
+        dst, dev = self.targets[root]
+        if dev is None:
+            return False
+        target = dst + path[len(root):]
+        if os.path.lexists(target):
+            return False
+        try:
+            return os.lstat(path).st_dev == dev
+        except OSError:
+            return False
+
+    def probe(self, root):
+        dst = _get_target(root, self.dst, len(self.src) > 1)
+        if _is_within(util.unix_dirname(dst), root):
+            return (dst, None)
+        dev = _get_device(util.unix_dirname(dst))
+        try:
+            if os.lstat(root).st_dev != dev:
+                return (dst, None)
+        except OSError:
+            return (dst, None)
+        return (dst, dev)
+
+def _is_within(path, root):
+    return (path.rstrip(os.sep) + os.sep).startswith(root.rstrip(os.sep) + os.sep)
+
+def _get_target(src, dst, join):
+    if join or os.path.isdir(dst) or dst.endswith(os.sep):
+        return os.path.join(dst, util.unix_basename(src))
+    return dst
 
 class FileJobGenerator(object):
-    def __init__(self):
+    def __init__(self, defer=False):
         self.confirm = "Importunate"
+        self.defer = defer
+        self.dirpairs = []
 
-    def generate(self, src, dst, moving, join=False):
-        def _checkfile(src, dst):
-            ret = self.check_override(src, dst)
-            if ret == "Cancel":
-                raise FilectrlCancel("Filejob canceled: {0} -> {1}".format(src, dst))
-            if ret == "Yes":
-                return FileJob(src, dst)
-
-        def _checkdir(src, dst):
-            copypair = None
-            if not os.path.isdir(dst):
-                copypair = (os.stat(src), dst)
-
-            for f in os.listdir(src):
-                ssub = os.path.join(src, f)
-                dsub = os.path.join(dst, f)
-                if os.path.isdir(ssub) and not os.path.islink(ssub):
-                    for checked in _checkdir(ssub, dsub):
-                        yield checked
-                else:
-                    yield _checkfile(ssub, dsub)
-            if copypair:
-                self.copydir(copypair)
-            if moving:
-                self.removedir(src)
-
-        if join or os.path.isdir(dst) or dst.endswith(os.sep):
-            dst = os.path.join(dst, util.unix_basename(src))
+    def generate(self, src, dst, moving, join, planner):
+        dst = _get_target(src, dst, join)
 
-        if util.unix_dirname(dst).startswith(src):
+        if _is_within(util.unix_dirname(dst), src):
             raise FilectrlCancel("Cannot copy/move a directory, `{0}', into itself, `{1}'".format(src, dst))
 
-        if os.path.isdir(src) and not os.path.islink(src):
-            for checked in _checkdir(src, dst):
-                yield checked
-        else:
-            yield _checkfile(src, dst)
+        for job in self.walk(src, dst, moving, planner, planner.events()):
+            yield job
+
+    def walk(self, src, dst, moving, planner, events):
+        copypairs = []
+        for event, path, size in events:
+            target = dst + path[len(src):]
+            if event == "file":
+                job = self.checkfile(path, target)
+                if job is None:
+                    planner.progress.add(size)
+                else:
+                    job.size = size
+                yield job
+            elif event == "tree":
+                if self.renametree(path, target):
+                    yield None
+                else:
+                    for job in self.walk(path, target, moving, planner, planner.events(path)):
+                        yield job
+            elif event == "enter":
+                copypair = None
+                if not os.path.isdir(target):
+                    copypair = (os.stat(path), target)
+                    if self.defer:
+                        _makedirs(target)
+                copypairs.append(copypair)
+            else:
+                copypair = copypairs.pop()
+                if copypair:
+                    if self.defer:
+                        self.dirpairs.append(copypair)
+                    else:
+                        self.copydir(copypair)
+                if moving:
+                    self.removedir(path)
+            if not copypairs:
+                break
+
+    def checkfile(self, src, dst):
+        ret = self.check_override(src, dst)
+        if ret == "Cancel":
+            raise FilectrlCancel("Filejob canceled: {0} -> {1}".format(src, dst))
+        if ret == "Yes":
+            return FileJob(src, dst)
+
+    def renametree(self, src, dst):
+        if os.path.lexists(dst):
+            return False
+        try:
+            _makedirs(util.unix_dirname(dst))
+            os.rename(src, dst)
+        except OSError:
+            return False
+        return True
 
     def check_override(self, src, dst):
         if not os.path.lexists(dst) or \
@@ -838,42 +1879,117 @@ class FileJobGenerator(object):
         except Exception as e:
             message.exception(e)
 
+    def copydirs(self):
+        for pair in self.dirpairs:
+            self.copydir(pair)
+        self.dirpairs = []
+
     def removedir(self, directory):
         try:
             os.rmdir(directory)
-        except Exception as e:
-            if e[0] != errno.ENOTEMPTY:
+        except OSError as e:
+            if e.errno != errno.ENOTEMPTY:
                 message.exception(e)
 
+FICLONE = 0x40049409
+
+_unsupported_errnos = set(getattr(errno, name) for name in
+                          ("ENOSYS", "EXDEV", "EINVAL", "EOPNOTSUPP", "ENOTSUP",
+                           "EBADF", "ENOTTY", "EPERM", "ETXTBSY")
+                          if hasattr(errno, name))
+
+_buffers = threading.local()
+
+_O_DIRECTORY = getattr(os, "O_DIRECTORY", 0)
+_O_NOFOLLOW = getattr(os, "O_NOFOLLOW", 0)
+_dir_fd_support = (hasattr(os, "supports_dir_fd") and hasattr(os, "scandir") and
+                   os.open in os.supports_dir_fd and
+                   os.unlink in os.supports_dir_fd and
+                   os.rmdir in os.supports_dir_fd and
+                   os.scandir in os.supports_fd)
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def _copy_clone(fsrc, fdst, size, progress):
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (ImportError, IOError, OSError):
+        return False
+    progress(size)
+    return True
+
+def _copy_kernel(sysfunc, fsrc, fdst, size, progress):
+    copied = 0
+    while True:
+        try:
+            n = sysfunc(fsrc.fileno(), fdst.fileno(), FileJob.chunksize)
+        except OSError as e:
+            if e.errno in _unsupported_errnos:
+                return False
+            raise
+        if not n:
+            # Pseudo files such as /proc and sysfs report size 0 and EOF
+            # at once; let the next method copy them through user space.
+            return copied != 0
+        copied += n
+        progress(n)
+
+def _copy_file_range(fsrc, fdst, size, progress):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    return _copy_kernel(os.copy_file_range, fsrc, fdst, size, progress)
+
+def _copy_sendfile(fsrc, fdst, size, progress):
+    if not hasattr(os, "sendfile"):
+        return False
+    sendfile = lambda infd, outfd, count: os.sendfile(outfd, infd, None, count)
+    return _copy_kernel(sendfile, fsrc, fdst, size, progress)
+
+def _copy_readinto(fsrc, fdst, size, progress):
+    buf = getattr(_buffers, "buf", None)
+    if buf is None or len(buf) != FileJob.bufsize:
+        buf = _buffers.buf = bytearray(FileJob.bufsize)
+    view = memoryview(buf)
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            return True
+        pos = 0
+        while pos < n:
+            pos += fdst.write(view[pos:n])
+        progress(n)
+
 class FileJob(object):
+    chunksize = 8*1024*1024
+    bufsize = 1024*1024
+    copiers = [_copy_clone, _copy_file_range, _copy_sendfile, _copy_readinto]
+
     def __init__(self, src, dst):
         self.src = src
         self.dst = dst
-
-    def copyfileobj(self, fsrc, fdst, length=16*1024):
-        curval = 0
-        navbar = widget.get("NavigationBar")
-        size = os.stat(self.src).st_size
-        if size:
-            gauge = ProgressGauge(size)
-        else:
-            gauge = ProgressGauge(1)
-        while True:
-            buf = fsrc.read(length)
-            if not buf:
-                gauge.finish()
-                if not widgets.cmdline.active:
-                    navbar.draw(gauge.draw, 1, 1)
+        self.size = 0
+        self.done = 0
+        self.progress = None
+
+    def copyfileobj(self, fsrc, fdst):
+        size = os.fstat(fsrc.fileno()).st_size
+        def _progress(n):
+            self.done += n
+            if self.progress is not None:
+                self.progress.add(n)
+        for copier in self.copiers:
+            if copier(fsrc, fdst, size, _progress):
                 break
-            curval += len(buf)
-            gauge.update(curval)
-            if not widgets.cmdline.active:
-                navbar.draw(gauge.draw, 1, 1)
-            fdst.write(buf)
 
     def copyfile(self, src, dst):
-        with open(src, "rb") as fsrc:
-            with open(dst, "wb") as fdst:
+        with io.open(src, "rb", buffering=0) as fsrc:
+            with io.open(dst, "wb", buffering=0) as fdst:
                 self.copyfileobj(fsrc, fdst)
 
     def copysymlink(self, src, dst):
@@ -882,33 +1998,41 @@ class FileJob(object):
         linkto = os.readlink(src)
         os.symlink(linkto, dst)
 
-    def copy(self):
+    def transfer(self, progress=None):
+        self.progress = progress
+        if not os.path.isdir(util.unix_dirname(self.dst)):
+            _makedirs(util.unix_dirname(self.dst))
+        if os.path.isfile(self.dst):
+            if not os.access(self.dst, os.W_OK):
+                os.remove(self.dst)
+        if os.path.islink(self.src):
+            self.copysymlink(self.src, self.dst)
+        else:
+            self.copyfile(self.src, self.dst)
+            shutil.copystat(self.src, self.dst)
+
+    def copy(self, progress=None):
         try:
-            if not os.path.isdir(util.unix_dirname(self.dst)):
-                os.makedirs(util.unix_dirname(self.dst))
-            if os.path.isfile(self.dst):
-                if not os.access(self.dst, os.W_OK):
-                    os.remove(self.dst)
-            if os.path.islink(self.src):
-                self.copysymlink(self.src, self.dst)
-            else:
-                self.copyfile(self.src, self.dst)
-                shutil.copystat(self.src, self.dst)
+            self.transfer(progress)
         except Exception as e:
             message.exception(e)
             raise FilectrlCancel("Exception occurred while copying")
 
-    def move(self):
+    def move(self, progress=None):
+        self.progress = progress
         try:
             if not os.path.isdir(util.unix_dirname(self.dst)):
                 os.makedirs(util.unix_dirname(self.dst))
             if os.path.isfile(self.dst):
                 if not os.access(self.dst, os.W_OK):
                     os.remove(self.dst)
+            st = os.lstat(self.src)
             os.rename(self.src, self.dst)
+            if progress is not None and stat.S_ISREG(st.st_mode):
+                progress.add(st.st_size)
         except Exception as e:
-            if errno.EXDEV == e[0]:
-                self.copy()
+            if errno.EXDEV == getattr(e, "errno", None):
+                self.copy(progress)
                 try:
                     os.remove(self.src)
                 except Exception as e:
@@ -0,0 +1,365 @@
+# fileindex.py - persistent file name index
+#
+# Copyright (C) 2010-2011 anmitsu <anmitsu.s@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import array
+import bisect
+import fnmatch
+import glob
+import hashlib
+import marshal
+import os
+import re
+import threading
+import time
+
+from pyful import message
+from pyful import util
+
+VERSION = 1
+
+def _tobytes(a):
+    if hasattr(a, "tobytes"):
+        return a.tobytes()
+    return a.tostring()
+
+def _toarray(b):
+    a = array.array("I")
+    if hasattr(a, "frombytes"):
+        a.frombytes(b)
+    else:
+        a.fromstring(b)
+    return a
+
+def _trigrams(name):
+    name = name.lower()
+    return set(name[i:i+3] for i in range(len(name)-2))
+
+def _literals(pattern):
+    return [s for s in re.split(r"[*?]|\[[^\]]*\]", pattern) if s]
+
+class IndexData(object):
+    def __init__(self, root, dirs, mtimes, starts, entries, isdir, names, nstarts, nentries, grams):
+        self.root = root
+        self.dirs = dirs
+        self.mtimes = mtimes
+        self.starts = starts
+        self.entries = entries
+        self.isdir = isdir
+        self.names = names
+        self.nstarts = nstarts
+        self.nentries = nentries
+        self.grams = grams
+        self.dirids = None
+
+    @classmethod
+    def scan(cls, root, old=None):
+        olddirs = {}
+        if old is not None and old.root == root:
+            olddirs = dict((d, i) for i, d in enumerate(old.dirs))
+        ids = {}
+        names = []
+        dirs = []
+        mtimes = []
+        starts = array.array("I", [0])
+        entries = array.array("I")
+        isdir = bytearray()
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(root, rel)
+            try:
+                if rel:
+                    mtime = os.lstat(path).st_mtime
+                else:
+                    mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            i = olddirs.get(rel)
+            if i is not None and old.mtimes[i] == mtime:
+                children = old.children(i)
+            else:
+                children = cls.listdir(path)
+            for name, d in children:
+                nid = ids.get(name)
+                if nid is None:
+                    nid = ids[name] = len(names)
+                    names.append(name)
+                entries.append(nid)
+                isdir.append(d)
+                if d:
+                    stack.append(os.path.join(rel, name))
+            dirs.append(rel)
+            mtimes.append(mtime)
+            starts.append(len(entries))
+        return cls.build(root, dirs, mtimes, starts, entries, isdir, names)
+
+    @classmethod
+    def listdir(cls, path):
+        children = []
+        try:
+            for entry in util.scandir(path):
+                try:
+                    children.append((entry.name, int(entry.is_dir(follow_symlinks=False))))
+                except OSError:
+                    continue
+        except OSError:
+            pass
+        return children
+
+    @classmethod
+    def build(cls, root, dirs, mtimes, starts, entries, isdir, names):
+        order = sorted(range(len(names)), key=names.__getitem__)
+        rank = array.array("I", [0]) * len(names)
+        for r, nid in enumerate(order):
+            rank[nid] = r
+        names = [names[nid] for nid in order]
+        entries = array.array("I", [rank[e] for e in entries])
+
+        nstarts = array.array("I", [0]) * (len(names)+1)
+        for e in entries:
+            nstarts[e+1] += 1
+        for i in range(len(names)):
+            nstarts[i+1] += nstarts[i]
+        fill = array.array("I", nstarts)
+        nentries = array.array("I", [0]) * len(entries)
+        for j, e in enumerate(entries):
+            nentries[fill[e]] = j
+            fill[e] += 1
+
+        grams = {}
+        for nid, name in enumerate(names):
+            for g in _trigrams(name):
+                posting = grams.get(g)
+                if posting is None:
+                    posting = grams[g] = array.array("I")
+                posting.append(nid)
+        return cls(root, dirs, mtimes, starts, entries, isdir, names, nstarts, nentries, grams)
+
+    @classmethod
+    def unpack(cls, obj):
+        (version, root, dirs, mtimes, starts, entries, isdir,
+         names, nstarts, nentries, grams) = obj
+        if version != VERSION:
+            raise ValueError("Index version mismatch")
+        grams = dict((g, _toarray(b)) for g, b in grams.items())
+        return cls(root, dirs, mtimes, _toarray(starts), _toarray(entries), bytearray(isdir),
+                   names, _toarray(nstarts), _toarray(nentries), grams)
+
+    def pack(self):
+        grams = dict((g, _tobytes(a)) for g, a in self.grams.items())
+        return (VERSION, self.root, self.dirs, self.mtimes,
+                _tobytes(self.starts), _tobytes(self.entries), bytes(self.isdir),
+                self.names, _tobytes(self.nstarts), _tobytes(self.nentries), grams)
+
+    def children(self, i):
+        names = self.names
+        entries = self.entries
+        isdir = self.isdir
+        return [(names[entries[j]], isdir[j]) for j in range(self.starts[i], self.starts[i+1])]
+
+    def dirid(self, rel):
+        if self.dirids is None:
+            self.dirids = dict((d, i) for i, d in enumerate(self.dirs))
+        return self.dirids.get(rel)
+
+    def relpath(self, path):
+        if path == self.root:
+            return ""
+        return path[len(os.path.join(self.root, "")):]
+
+    def candidates(self, pattern):
+        if not glob.has_magic(pattern):
+            i = bisect.bisect_left(self.names, pattern)
+            if i < len(self.names) and self.names[i] == pattern:
+                return [i]
+            return []
+        postings = []
+        for literal in _literals(pattern):
+            for g in _trigrams(literal):
+                posting = self.grams.get(g)
+                if posting is None:
+                    return []
+                postings.append(posting)
+        if not postings:
+            return range(len(self.names))
+        postings.sort(key=len)
+        found = set(postings[0])
+        for posting in postings[1:]:
+            found.intersection_update(posting)
+            if not found:
+                break
+        return sorted(found)
+
+    def find(self, pattern, under="", dirsonly=False):
+        match = re.compile(fnmatch.translate(pattern)).match
+        prefix = os.path.join(under, "")
+        for nid in self.candidates(pattern):
+            name = self.names[nid]
+            if not match(name):
+                continue
+            for k in range(self.nstarts[nid], self.nstarts[nid+1]):
+                j = self.nentries[k]
+                if dirsonly and not self.isdir[j]:
+                    continue
+                path = os.path.join(self.dirs[bisect.bisect_right(self.starts, j)-1], name)
+                if not under:
+                    yield path
+                elif path.startswith(prefix):
+                    yield path[len(prefix):]
+
+    def glob(self, pattern):
+        parts = self.relpath(pattern).split(os.sep)
+        paths = [""]
+        for n, part in enumerate(parts):
+            last = n == len(parts) - 1
+            magic = glob.has_magic(part)
+            match = re.compile(fnmatch.translate(part)).match
+            found = []
+            for path in paths:
+                i = self.dirid(path)
+                if i is None:
+                    continue
+                for name, d in self.children(i):
+                    if not (last or d):
+                        continue
+                    if magic:
+                        if name.startswith(".") and not part.startswith("."):
+                            continue
+                        if not match(name):
+                            continue
+                    elif name != part:
+                        continue
+                    found.append(os.path.join(path, name))
+            paths = found
+        return [os.path.join(self.root, path) for path in paths]
+
+class IndexThread(threading.Thread):
+    def __init__(self, index):
+        threading.Thread.__init__(self)
+        self.index = index
+        self.setDaemon(True)
+
+    def run(self):
+        try:
+            self.index.refresh()
+        except Exception as e:
+            message.exception(e)
+
+class FileIndex(object):
+    roots = []
+    path = "~/.pyful/index"
+    interval = 3600
+    indexes = {}
+
+    @classmethod
+    def start(cls):
+        for root in cls.roots:
+            cls.get(util.abspath(root)).update()
+
+    @classmethod
+    def get(cls, root):
+        index = cls.indexes.get(root)
+        if index is None:
+            index = cls.indexes[root] = cls(root)
+        return index
+
+    @classmethod
+    def lookup(cls, path):
+        root = None
+        for r in cls.roots:
+            r = util.abspath(r)
+            if path == r or path.startswith(os.path.join(r, "")):
+                if root is None or len(r) > len(root):
+                    root = r
+        if root is None:
+            return None
+        index = cls.get(root)
+        index.update()
+        if index.data is None:
+            return None
+        return index
+
+    @classmethod
+    def find_dirs(cls, pattern):
+        found = []
+        for root in cls.roots:
+            index = cls.lookup(util.abspath(root))
+            if index is None:
+                continue
+            data = index.data
+            for path in data.find(pattern, dirsonly=True):
+                path = os.path.join(data.root, path)
+                if path not in found:
+                    found.append(path)
+        return sorted(found)
+
+    def __init__(self, root):
+        self.root = root
+        key = root if isinstance(root, bytes) else root.encode("utf-8", "replace")
+        self.filename = os.path.join(util.expanduser(self.path), hashlib.md5(key).hexdigest())
+        self.data = None
+        self.stamp = 0
+        self.loaded = False
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def update(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.loaded and time.time() - self.stamp < self.interval:
+                return
+            self.thread = IndexThread(self)
+            self.thread.start()
+
+    def refresh(self):
+        if not self.loaded:
+            self.load()
+            self.loaded = True
+        if self.data is None or time.time() - self.stamp >= self.interval:
+            data = IndexData.scan(self.root, self.data)
+            self.data = data
+            self.stamp = time.time()
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.filename, "rb") as f:
+                stamp, obj = marshal.load(f)
+            data = IndexData.unpack(obj)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return
+        if data.root == self.root:
+            self.data = data
+            self.stamp = stamp
+
+    def save(self):
+        dirname = os.path.dirname(self.filename)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as f:
+            marshal.dump((self.stamp, self.data.pack()), f)
+        os.rename(tmp, self.filename)
+
+    def find(self, pattern, under):
+        data = self.data
+        return list(data.find(pattern, data.relpath(under)))
+
+    def glob(self, pattern):
+        return self.data.glob(pattern)
@@ -16,6 +16,9 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import array
+import bisect
+import collections
 import curses
 import errno
 import fnmatch
@@ -26,15 +29,20 @@ import os
 import pwd
 import re
 import stat
+import sys
+import threading
 import time
 
+from pyful import fileindex
 from pyful import look
 from pyful import message
 from pyful import util
 
 from pyful.widget.base import StandardScreen, Screen, Widget
 from pyful.widget.textbox import TextBox
-from pyful.widget.listbox import ListBox, Entry
+from pyful.widget.listbox import ListBox
+from pyful.widget.ui import Poller
+from pyful.watcher import watcher
 
 class NavigationBar(Widget):
     def __init__(self):
@@ -408,6 +416,7 @@ class Workspace(StandardScreen):
             return
         d = self.dirs[x]
         self.dirs.remove(d)
+        watcher.unwatch(d)
         if self.cursor > len(self.dirs) - 1:
             self.setcursor(len(self.dirs)-1)
         self.setcursor(self.cursor)
@@ -599,16 +608,21 @@ class Workspace(StandardScreen):
         self.dir.reload()
         os.chdir(self.dir.path)
 
-    def all_reload(self):
+    def all_reload(self, force=False):
         for d in self.dirs:
-            d.reload()
+            if force:
+                d.reload()
+            else:
+                d.sync()
         os.chdir(self.dir.path)
 
     def clear(self):
         for d in self.dirs:
+            watcher.unwatch(d)
             d.screen.unlink_window()
             d.finder.panel.unlink_window()
             d.files[:] = []
+            d.listed = False
 
     def draw(self):
         if self.layout == "Fullscreen":
@@ -622,6 +636,7 @@ class Workspace(StandardScreen):
 class Directory(StandardScreen):
     sort_kind = "Name[^]"
     sort_updir = False
+    render_cache = 4096
     scroll_type = "HalfScroll"
     statusbar_format = " [{MARK}/{FILE}] {MARKSIZE}bytes {SCROLL}({CURSOR}) {SORT} "
 
@@ -641,6 +656,11 @@ class Directory(StandardScreen):
         self.finder = Finder(self)
         self.pager = Pager(self)
         self.history = PathHistory(self)
+        self.statpool = None
+        self.globsearch = None
+        self.listloader = None
+        self.listed = False
+        self.rows = collections.OrderedDict()
 
     @property
     def file(self):
@@ -668,16 +688,12 @@ class Directory(StandardScreen):
         if amount > 0:
             if bottom >= len(self.files):
                 return
-            for f in self.files[self.scrolltop:self.scrolltop+amount]:
-                f.cache_clear()
             self.scrolltop += amount
             if self.cursor < self.scrolltop:
                 self.cursor = self.scrolltop
         else:
             if self.scrolltop == 0:
                 return
-            for f in self.files[bottom+amount:bottom]:
-                f.cache_clear()
             self.scrolltop += amount
             bottom += amount
             if self.cursor >= bottom:
@@ -688,8 +704,6 @@ class Directory(StandardScreen):
         size = len(self.files)
         if self.scrolltop+height >= size:
             return
-        for f in self.files[self.scrolltop:self.scrolltop+height]:
-            f.cache_clear()
         self.scrolltop += height
         self.cursor += height
 
@@ -697,8 +711,6 @@ class Directory(StandardScreen):
         if self.scrolltop == 0:
             return
         height = self.screen.win.getmaxyx()[0] - 2
-        for f in self.files[self.scrolltop:self.scrolltop+height]:
-            f.cache_clear()
         self.scrolltop -= height
         self.cursor -= height
 
@@ -715,46 +727,56 @@ class Directory(StandardScreen):
 
     def glob(self, pattern):
         self.list_title = "Grob:({0})".format(pattern)
-        self.list = list(glob.iglob(pattern))
+        path = os.path.normpath(os.path.join(self.path, pattern))
+        index = None
+        if glob.has_magic(pattern) and os.sep in pattern.rstrip(os.sep) and not pattern.endswith(os.sep):
+            index = fileindex.FileIndex.lookup(path)
+        if index:
+            files = index.glob(path)
+            if not os.path.isabs(pattern):
+                files = [os.path.relpath(f, self.path) for f in files]
+            self.list = files
+        else:
+            self.list = list(glob.iglob(pattern))
         self.reload()
 
     def globdir(self, pattern):
-        def _globdir(dirname):
-            try:
-                files = os.listdir(util.U(dirname))
-            except OSError:
-                return
-            for f in files:
-                try:
-                    path = os.path.join(dirname, f)
-                except UnicodeError:
-                    continue
-                if os.path.isdir(path) and not os.path.islink(path):
-                    for sub in _globdir(path):
-                        yield sub
-                if fnmatch.fnmatch(f, pattern):
-                    yield os.path.normpath(path)
+        if self.globsearch:
+            self.globsearch.cancel()
         self.list_title = "Grobdir:({0})".format(pattern)
-        self.list = list(_globdir(os.curdir))
+        index = fileindex.FileIndex.lookup(self.path)
+        if index:
+            self.list = index.find(pattern, self.path)
+            self.reload()
+            return
+        self.list = []
         self.reload()
+        self.globsearch = GlobSearch(self, pattern)
+        self.globsearch.start()
+
+    def add_list(self, fstats):
+        fname = self.file.name
+        cursor = self.cursor
+        self.list.extend(fs.name for fs in fstats)
+        fstats = [fs for fs in fstats if self.visible(fs)]
+        self.merge_files(fstats, fname, cursor)
 
     def open_listfile(self, path):
+        if self.listloader:
+            self.listloader.cancel()
         self.list_title = "File:({0})".format(path)
         self.list = []
-        try:
-            with open(path, "r") as f:
-                for line in f:
-                    line = line.strip(os.linesep)
-                    if os.path.exists(line):
-                        line = re.sub("{0}?{1}".format(self.path, os.sep), "", line)
-                        self.list.append(line)
-        except Exception as e:
-            message.exception(e)
         self.reload()
+        self.listloader = ListLoader(self, path)
+        self.listloader.start()
 
     def reset(self):
         if self.ismark():
             self.mark_clear()
+        elif self.globsearch and self.globsearch.active:
+            self.globsearch.cancel()
+        elif self.listloader and self.listloader.active:
+            self.listloader.cancel()
         elif self.list is not None:
             self.list = None
             self.list_title = None
@@ -763,34 +785,154 @@ class Directory(StandardScreen):
             self.maskreg = None
             self.reload()
 
-    def diskread(self):
+    def diskread(self, cache=False):
         marks = set(f.name for f in self.mark_files)
+        self.rows.clear()
         self.files[:] = [FileStat(os.pardir)]
         self.mark_files.clear()
+        if self.statpool:
+            self.statpool.cancel()
+            self.statpool = None
 
+        pooling = False
         if self.finder.active:
-            filelist = self.finder.results
+            fstats = self._readlist([f.name for f in self.finder.results])
+        elif self.listloader and self.list is self.listloader.list:
+            fstats = self.listloader.lazystats(self.list)
+            pooling = StatPool.workers > 0 and self.sort_needs_type()
         elif self.list is not None:
-            filelist = self.list
+            fstats = self._readlist(self.list)
         else:
-            filelist = os.listdir(self.path)
+            pooling = StatPool.usable(self.path)
+            if FileStat.lazy or pooling:
+                fstats = self._readdir(True)
+            else:
+                fstats = self._readcache(cache)
+        for fs in fstats:
+            if self.visible(fs):
+                self.files.append(fs)
+        if pooling and (not FileStat.lazy or self.sort_needs_type()):
+            self.pool_stats()
+        self.mark_update([f for f in self.files if f.name in marks])
+        if self.finder.active:
+            self.finder.update(self.files)
+        elif self.list is None:
+            watcher.watch(self)
+        else:
+            watcher.unwatch(self)
+        self.listed = True
+
+    def _readdir(self, lazy=False):
+        for entry in util.scandir(self.path):
+            try:
+                if lazy:
+                    yield FileStat(entry.name, typemode=_entry_typemode(entry), dirname=self.path)
+                else:
+                    yield FileStat(entry.name, entry.stat(follow_symlinks=False), dirname=self.path)
+            except (OSError, InvalidEncodingError):
+                continue
+
+    def _readcache(self, cache=False):
+        entries = None
+        if cache:
+            entries = ListingCache.get(self.path)
+        if entries is not None:
+            for name, fields in entries:
+                fs = FileStat(name, typemode=fields[0], dirname=self.path)
+                fs.setfields(fields)
+                yield fs
+            return
+        stamp = ListingCache.stamp(self.path)
+        entries = []
+        for fs in self._readdir():
+            entries.append((fs.name, fs.fields()))
+            yield fs
+        ListingCache.store(self.path, stamp, entries)
+
+    def _readlist(self, filelist):
         for f in filelist:
-            if not os.path.lexists(f):
+            try:
+                yield FileStat(f, os.lstat(f), dirname=self.path)
+            except (OSError, InvalidEncodingError):
                 continue
+
+    def sync(self):
+        if self.list is None and not self.finder.active and watcher.watching(self):
+            watcher.poll()
+        elif not self.listed:
+            self.reload(cache=True)
+        else:
+            self.reload()
+
+    def apply_changes(self, names):
+        if self.list is not None or self.finder.active:
+            return
+        ListingCache.discard(self.path)
+        fname = self.file.name
+        cursor = self.cursor
+        marks = set(f.name for f in self.mark_files if f.name in names)
+        for f in [f for f in self.mark_files if f.name in names]:
+            self.mark_files.discard(f)
+        self.files[:] = [f for f in self.files if f.name not in names]
+        added = []
+        for name in names:
             try:
-                fs = FileStat(f)
-            except InvalidEncodingError:
+                fs = FileStat(name, os.lstat(os.path.join(self.path, name)), dirname=self.path)
+            except (OSError, InvalidEncodingError):
                 continue
-            if self.maskreg:
-                if not (fs.isdir() or self.maskreg.search(fs.name)):
+            if not self.visible(fs):
                     continue
-            self.files.append(fs)
-        self.mark_update([f for f in self.files if f.name in marks])
+            added.append(fs)
+        self.merge_files(added, fname, cursor)
+        self.mark_update([f for f in added if f.name in marks])
+
+    def merge_files(self, added, fname, cursor):
+        if len(added) > 64:
+            self.files.extend(added)
+            self.sort()
+        else:
+            for fs in added:
+                self.insort(fs)
+        for i, f in enumerate(self.files):
+            if f.name == fname:
+                self.setcursor(i)
+                break
+        else:
+            self.setcursor(min(cursor, len(self.files)-1))
 
-    def reload(self):
+    def insort(self, fs):
+        if self.stat_pending() and self.sort_needs_stat():
+            kind = "Name"
+        else:
+            kind = self.sort_kind[:-3]
+        key = self.sort_key(kind)
+        rev = self.sort_kind.endswith("[$]")
+        fkey = key(fs)
+        pending = self.stat_pending()
+        fdir = _isdir(fs, pending)
+        lo = 0
+        if self.files and self.files[0].name == os.pardir:
+            lo = 1
+        hi = len(self.files)
+        while lo < hi:
+            mid = (lo+hi) // 2
+            f = self.files[mid]
+            if self.sort_updir and _isdir(f, pending) != fdir:
+                before = not fdir
+            elif rev:
+                before = fkey < key(f)
+            else:
+                before = key(f) < fkey
+            if before:
+                lo = mid + 1
+            else:
+                hi = mid
+        self.files.insert(lo, fs)
+
+    def reload(self, cache=False):
         try:
             os.chdir(self.path)
-            self.diskread()
+            self.diskread(cache)
             self.sort()
         except Exception as e:
             message.exception(e)
@@ -815,13 +957,22 @@ class Directory(StandardScreen):
             return message.exception(e)
         self.history.update(newpath)
         self.path = newpath
-        self.diskread()
+        self.diskread(cache=True)
         self.sort()
         if self.path == parpath:
             self.setcursor(self.get_index(parfile))
         else:
             self.setcursor(0)
 
+    def setfiles(self, files):
+        self.files[:] = [f for f in self.files[:1] if f.name == os.pardir] + files
+        if self.mark_files:
+            visible = set(files)
+            for f in [f for f in self.mark_files if f not in visible]:
+                f.markoff()
+                self.mark_files.discard(f)
+            self.mark_size = self.get_mark_size()
+
     def get_index(self, fname):
         for i, f in enumerate(self.files):
             if fname == f.name:
@@ -887,7 +1038,7 @@ class Directory(StandardScreen):
     def get_mark_size(self):
         if not self.mark_files:
             return "0"
-        size = sum(f.stat.st_size for f in self.mark_files if not f.isdir())
+        size = sum(f.load().size for f in self.mark_files if not f.isdir())
         return re.sub(r"(\d)(?=(?:\d\d\d)+(?!\d))", r"\1,", str(size))
 
     def get_mark_files(self):
@@ -896,114 +1047,103 @@ class Directory(StandardScreen):
     def ismark(self):
         return len(self.mark_files) != 0
 
-    def sort(self):
-        if self.sort_kind == "Name[^]": self.sort_name(rev=False)
-        elif self.sort_kind == "Name[$]": self.sort_name(rev=True)
-        elif self.sort_kind == "Size[^]": self.sort_size(rev=False)
-        elif self.sort_kind == "Size[$]": self.sort_size(rev=True)
-        elif self.sort_kind == "Time[^]": self.sort_time(rev=False)
-        elif self.sort_kind == "Time[$]": self.sort_time(rev=True)
-        elif self.sort_kind == "Permission[^]": self.sort_permission(rev=False)
-        elif self.sort_kind == "Permission[$]": self.sort_permission(rev=True)
-        elif self.sort_kind == "Link[^]": self.sort_nlink(rev=False)
-        elif self.sort_kind == "Link[$]": self.sort_nlink(rev=True)
-        elif self.sort_kind == "Ext[^]": self.sort_ext(rev=False)
-        elif self.sort_kind == "Ext[$]": self.sort_ext(rev=True)
-
-    def _sort_default(self, sortfunc, x, y, rev):
-        if x.name == os.pardir:
-            return -1
-        if y.name == os.pardir:
-            return 1
-        if self.sort_updir:
-            xdir = x.isdir()
-            ydir = y.isdir()
-            if xdir == ydir:
-                return sortfunc(x, y, rev)
+    sort_keys = {
+        "Name": None,
+        "Size": lambda f: f.load().size,
+        "Time": lambda f: f.load().mtime,
+        "Permission": lambda f: f.load().mode,
+        "Link": lambda f: f.load().nlink,
+        "Ext": lambda f: util.extname(f.name),
+        }
+
+    def sort_needs_stat(self):
+        return not (self.sort_kind.startswith("Name") or self.sort_kind.startswith("Ext"))
+
+    def sort_needs_type(self):
+        return self.sort_needs_stat() or self.sort_updir or self.maskreg is not None
+
+    def visible(self, fs):
+        # An entry of a list file has no type until it is stat'ed, so it
+        # stays until the StatPool tells whether it is a directory.
+        if self.maskreg is None or self.maskreg.search(fs.name):
+            return True
+        if not fs.typed() and StatPool.workers > 0:
+            return True
+        return fs.isdir()
+
+    def drop_hidden(self):
+        files = []
+        for f in self.files:
+            if f.name == os.pardir or self.visible(f):
+                files.append(f)
             else:
-                return 1 if ydir == 1 else -1
+                self.mark_files.discard(f)
+        self.files[:] = files
+
+    def stat_pending(self):
+        if self.statpool and self.statpool.active:
+            return True
+        return bool(self.listloader and self.listloader.active and self.list is self.listloader.list)
+
+    def pool_stats(self):
+        if self.statpool:
+            self.statpool.cancel()
+        self.statpool = StatPool(self)
+        self.statpool.start([f for f in self.files if not f.loaded()])
+
+    def sort(self):
+        kind = self.sort_kind[:-3]
+        rev = self.sort_kind.endswith("[$]")
+        if kind not in self.sort_keys:
+            return
+        if self.stat_pending() and self.sort_needs_stat():
+            sort_kind = self.sort_kind
+            self.sort_files("Name", rev)
+            self.sort_kind = sort_kind
         else:
-            return sortfunc(x, y, rev)
+            self.sort_files(kind, rev)
+
+    def sort_key(self, kind=None):
+        if kind is None:
+            kind = self.sort_kind[:-3]
+        keyfunc = self.sort_keys.get(kind)
+        if keyfunc is None:
+            return lambda f: f.name
+        return lambda f: (keyfunc(f), f.name)
+
+    def sorted_files(self, files, kind, rev=False):
+        key = self.sort_key(kind)
+        updir = [f for f in files if f.name == os.pardir]
+        files = [f for f in files if f.name != os.pardir]
+        files.sort(key=key, reverse=rev)
+        if self.sort_updir:
+            pending = self.stat_pending()
+            files.sort(key=lambda f: not _isdir(f, pending))
+        return updir + files
+
+    def sort_files(self, kind, rev=False):
+        self.files[:] = self.sorted_files(self.files, kind, rev)
+        if self.finder.active:
+            self.finder.sort(kind, rev)
+        self.sort_kind = "{0}[{1}]".format(kind, "$" if rev else "^")
 
     def sort_name(self, rev=False):
-        def _namecompare(x, y, rev):
-            if rev:
-                return util.cmp(y.name, x.name)
-            else:
-                return util.cmp(x.name, y.name)
-        _sort = lambda x, y: self._sort_default(_namecompare, x, y, rev)
-        self.files.sort(key=util.cmp_to_key(_sort))
-        self.sort_kind = "Name[$]" if rev else "Name[^]"
+        self.sort_files("Name", rev)
 
     def sort_size(self, rev=False):
-        def _sizecompare(x, y, rev):
-            if rev:
-                ret = util.cmp(y.stat.st_size, x.stat.st_size) 
-            else:
-                ret = util.cmp(x.stat.st_size, y.stat.st_size)
-            if ret == 0:
-                return util.cmp(y.name, x.name) if rev else util.cmp(x.name, y.name)
-            else:
-                return ret
-        _sort = lambda x, y: self._sort_default(_sizecompare, x, y, rev)
-        self.files.sort(key=util.cmp_to_key(_sort))
-        self.sort_kind = "Size[$]" if rev else "Size[^]"
+        self.sort_files("Size", rev)
 
     def sort_permission(self, rev=False):
-        def _permcompare(x, y, rev):
-            if rev:
-                ret = util.cmp(y.stat.st_mode, x.stat.st_mode) 
-            else:
-                ret = util.cmp(x.stat.st_mode, y.stat.st_mode)
-            if ret == 0:
-                return util.cmp(y.name, x.name) if rev else util.cmp(x.name, y.name)
-            else:
-                return ret
-        _sort = lambda x, y: self._sort_default(_permcompare, x, y, rev)
-        self.files.sort(key=util.cmp_to_key(_sort))
-        self.sort_kind = "Permission[$]" if rev else "Permission[^]"
+        self.sort_files("Permission", rev)
 
     def sort_time(self, rev=False):
-        def _timecompare(x, y, rev):
-            if rev:
-                ret = util.cmp(y.stat.st_mtime, x.stat.st_mtime) 
-            else:
-                ret = util.cmp(x.stat.st_mtime, y.stat.st_mtime)
-            if ret == 0:
-                return util.cmp(y.name, x.name) if rev else util.cmp(x.name, y.name)
-            else:
-                return ret
-        _sort = lambda x, y: self._sort_default(_timecompare, x, y, rev)
-        self.files.sort(key=util.cmp_to_key(_sort))
-        self.sort_kind = "Time[$]" if rev else "Time[^]"
+        self.sort_files("Time", rev)
 
     def sort_nlink(self, rev=False):
-        def _nlinkcompare(x, y, rev):
-            if rev:
-                ret = util.cmp(y.stat.st_nlink, x.stat.st_nlink) 
-            else:
-                ret = util.cmp(x.stat.st_nlink, y.stat.st_nlink)
-            if ret == 0:
-                return util.cmp(y.name, x.name) if rev else util.cmp(x.name, y.name)
-            else:
-                return ret
-        _sort = lambda x, y: self._sort_default(_nlinkcompare, x, y, rev)
-        self.files.sort(key=util.cmp_to_key(_sort))
-        self.sort_kind = "Link[$]" if rev else "Link[^]"
+        self.sort_files("Link", rev)
 
     def sort_ext(self, rev=False):
-        def _extcompare(x, y, rev):
-            if rev:
-                ret = util.cmp(util.extname(y.name), util.extname(x.name)) 
-            else:
-                ret = util.cmp(util.extname(x.name), util.extname(y.name)) 
-            if ret == 0:
-                return util.cmp(y.name, x.name) if rev else util.cmp(x.name, y.name)
-            else:
-                return ret
-        _sort = lambda x, y: self._sort_default(_extcompare, x, y, rev)
-        self.files.sort(key=util.cmp_to_key(_sort))
-        self.sort_kind = "Ext[$]" if rev else "Ext[^]"
+        self.sort_files("Ext", rev)
 
     def resize(self, height, width, begy, begx):
         self.screen.resize(height, width, begy, begx)
@@ -1012,6 +1152,17 @@ class Directory(StandardScreen):
         self.finder.refresh()
         self.pager.refresh()
 
+    def render(self, f, width, key):
+        row = self.rows.pop(f, None)
+        if row is not None and row[0] == (key, f.name, f.fields()):
+            self.rows[f] = row
+            return row[1]
+        text = f.get_drawn_text(self.path, width)
+        self.rows[f] = ((key, f.name, f.fields()), text)
+        while len(self.rows) > self.render_cache:
+            self.rows.popitem(last=False)
+        return text
+
     def _fix_position(self, size, height):
         if self.cursor < 0:
             self.cursor = 0
@@ -1019,8 +1170,6 @@ class Directory(StandardScreen):
             self.cursor = size - 1
 
         if self.cursor >= self.scrolltop+height or self.cursor < self.scrolltop:
-            for f in self.files[self.scrolltop:self.scrolltop+height]:
-                f.cache_clear()
             if self.scroll_type == "HalfScroll":
                 self.scrolltop = self.cursor - (height//2)
             elif self.scroll_type == "PageScroll":
@@ -1087,11 +1236,16 @@ class Directory(StandardScreen):
             height -= self.finder.panel.y
         if not height:
             return
+        if self.listloader and self.list is self.listloader.list:
+            self._fix_position(size, height)
+            self.listloader.verify(self.scrolltop, height)
+            size = len(self.files)
 
         win.erase()
         win.border(*self.borders)
         self._draw_titlebar(width)
         self._fix_position(size, height)
+        key = FileStat.render_key(width)
 
         line = 0
         for i in range(self.scrolltop, size):
@@ -1100,7 +1254,7 @@ class Directory(StandardScreen):
                 break
 
             f = self.files[i]
-            fstr = f.get_drawn_text(self.path, width)
+            fstr = self.render(f, width, key)
             attr = f.get_attr()
             if self.cursor == i and focus:
                 attr += curses.A_REVERSE
@@ -1171,10 +1325,360 @@ class PathHistory(object):
         elif self.pos >= len(self.history):
             self.pos = len(self.history) - 1
 
+class ListingCache(object):
+    maxentries = 100000
+    snapshots = collections.OrderedDict()
+    size = 0
+
+    @classmethod
+    def generation(cls, path):
+        st = os.stat(path)
+        mtime = getattr(st, "st_mtime_ns", None)
+        if mtime is None:
+            mtime = int(st.st_mtime * 1000000000)
+        return (mtime, st.st_ino)
+
+    @classmethod
+    def stamp(cls, path):
+        # A directory changed within the last second may change again
+        # without moving its mtime, so its listing is not cached.
+        try:
+            gen = cls.generation(path)
+        except OSError:
+            return None
+        if time.time() - gen[0] / 1000000000.0 < 1:
+            return None
+        return gen
+
+    @classmethod
+    def get(cls, path):
+        snapshot = cls.snapshots.get(path)
+        if snapshot is None:
+            return None
+        try:
+            gen = cls.generation(path)
+        except OSError:
+            gen = None
+        if gen != snapshot[0]:
+            cls.discard(path)
+            return None
+        del cls.snapshots[path]
+        cls.snapshots[path] = snapshot
+        return snapshot[1]
+
+    @classmethod
+    def store(cls, path, gen, entries):
+        cls.discard(path)
+        if gen is None or not cls.maxentries or len(entries) > cls.maxentries // 2:
+            return
+        cls.snapshots[path] = (gen, entries)
+        cls.size += len(entries)
+        while cls.size > cls.maxentries:
+            gen, entries = cls.snapshots.popitem(last=False)[1]
+            cls.size -= len(entries)
+
+    @classmethod
+    def discard(cls, path):
+        snapshot = cls.snapshots.pop(path, None)
+        if snapshot is not None:
+            cls.size -= len(snapshot[1])
+
+    @classmethod
+    def clear(cls):
+        cls.snapshots.clear()
+        cls.size = 0
+        cls.size = 0
+
+class StatPool(object):
+    workers = 8
+    always = False
+    chunksize = 256
+    network_fstypes = ["nfs", "nfs4", "cifs", "smbfs", "smb3", "ncpfs", "afs",
+                       "9p", "ceph", "glusterfs", "lustre", "davfs", "sshfs"]
+
+    @classmethod
+    def usable(cls, path):
+        if cls.workers <= 0:
+            return False
+        if cls.always:
+            return True
+        fstype = util.get_fstype(path)
+        if fstype is None:
+            return False
+        return fstype in cls.network_fstypes or fstype.startswith("fuse.")
+
+    def __init__(self, directory):
+        self.dir = directory
+        self.fstats = []
+        self.pos = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        self.active = False
+
+    def start(self, fstats):
+        if not fstats:
+            return
+        self.fstats = fstats
+        self.pos = 0
+        self.active = True
+        nthreads = min(self.workers, (len(fstats)-1)//self.chunksize + 1)
+        for i in range(0, nthreads):
+            t = threading.Thread(target=self.work)
+            t.setDaemon(True)
+            self.threads.append(t)
+            t.start()
+        Poller.register(self.poll)
+
+    def cancel(self):
+        Poller.unregister(self.poll)
+        with self.lock:
+            self.pos = len(self.fstats)
+        self.active = False
+
+    def nextchunk(self):
+        with self.lock:
+            start = self.pos
+            self.pos += self.chunksize
+        return self.fstats[start:start+self.chunksize]
+
+    def work(self):
+        while True:
+            chunk = self.nextchunk()
+            if not chunk:
+                break
+            for f in chunk:
+                if not f.loaded():
+                    f.statfile()
+
+    def poll(self):
+        if [t for t in self.threads if t.is_alive()]:
+            return True
+        self.active = False
+        if self.dir.statpool is self and self.dir.sort_needs_type():
+            fname = self.dir.file.name
+            self.dir.drop_hidden()
+            self.dir.sort()
+            self.dir.setcursor(self.dir.get_index(fname))
+        return False
+
+class GlobSearch(object):
+    workers = 4
+
+    def __init__(self, directory, pattern):
+        self.dir = directory
+        self.pattern = pattern
+        self.match = re.compile(fnmatch.translate(pattern)).match
+        self.root = directory.path
+        self.prefix = os.path.join(directory.path, "")
+        self.dirs = [directory.path]
+        self.pending = 1
+        self.found = []
+        self.count = 0
+        self.cond = threading.Condition()
+        self.threads = []
+        self.active = False
+
+    def start(self):
+        self.active = True
+        for i in range(max(self.workers, 1)):
+            t = threading.Thread(target=self.work)
+            t.setDaemon(True)
+            self.threads.append(t)
+            t.start()
+        Poller.register(self.poll)
+
+    def cancel(self):
+        Poller.unregister(self.poll)
+        with self.cond:
+            self.active = False
+            self.dirs = []
+            self.cond.notify_all()
+        if self.dir.list is not None:
+            self.dir.list_title = "Grobdir:({0}) canceled".format(self.pattern)
+
+    def nextdir(self):
+        with self.cond:
+            while self.active and not self.dirs and self.pending:
+                self.cond.wait()
+            if not self.active or not self.dirs:
+                return None
+            return self.dirs.pop()
+
+    def work(self):
+        while True:
+            path = self.nextdir()
+            if path is None:
+                break
+            subdirs, found = self.scan(path)
+            with self.cond:
+                self.dirs.extend(subdirs)
+                self.pending += len(subdirs) - 1
+                self.found.extend(found)
+                self.cond.notify_all()
+
+    def scan(self, path):
+        subdirs = []
+        found = []
+        try:
+            entries = list(util.scandir(path))
+        except OSError:
+            return (subdirs, found)
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                if self.match(entry.name):
+                    name = entry.path[len(self.prefix):]
+                    found.append(FileStat(name, entry.stat(follow_symlinks=False), dirname=self.root))
+            except (OSError, InvalidEncodingError):
+                continue
+        return (subdirs, found)
+
+    def poll(self):
+        if self.dir.globsearch is not self or self.dir.list is None:
+            self.cancel()
+            return False
+        with self.cond:
+            found = self.found
+            self.found = []
+            done = not self.pending
+        if found:
+            self.count += len(found)
+            self.dir.add_list(found)
+        if done:
+            self.active = False
+            self.dir.list_title = "Grobdir:({0})".format(self.pattern)
+            return False
+        self.dir.list_title = "Grobdir:({0}) {1}...".format(self.pattern, self.count)
+        return True
+
+class ListLoader(object):
+    blocksize = 1024 * 1024
+    chunksize = 1000
+
+    def __init__(self, directory, path):
+        self.dir = directory
+        self.path = path
+        self.list = directory.list
+        self.prefix = _fsencode(os.path.join(directory.path, ""))
+        self.found = []
+        self.count = 0
+        self.done = False
+        self.error = None
+        self.lock = threading.Lock()
+        self.active = False
+
+    def start(self):
+        self.active = True
+        t = threading.Thread(target=self.read)
+        t.setDaemon(True)
+        t.start()
+        Poller.register(self.poll)
+
+    def cancel(self):
+        Poller.unregister(self.poll)
+        self.active = False
+        if self.dir.list is self.list:
+            self.dir.list_title = "File:({0}) canceled".format(self.path)
+
+    def read(self):
+        try:
+            for names in self.readnames():
+                fstats = list(self.lazystats(names))
+                with self.lock:
+                    self.found.extend(fstats)
+        except Exception as e:
+            self.error = e
+        with self.lock:
+            self.done = True
+
+    def readnames(self):
+        sep = None
+        rest = b""
+        with open(self.path, "rb") as f:
+            while self.active:
+                block = f.read(self.blocksize)
+                if sep is None:
+                    sep = b"\0" if b"\0" in block else b"\n"
+                if block:
+                    lines = (rest + block).split(sep)
+                    rest = lines.pop()
+                else:
+                    lines = [rest]
+                names = []
+                for line in lines:
+                    if line.startswith(self.prefix):
+                        line = line[len(self.prefix):]
+                    if sep == b"\n":
+                        line = line.rstrip(b"\r")
+                    if line:
+                        names.append(_fsdecode(line))
+                yield names
+                if not block:
+                    break
+
+    def lazystats(self, names):
+        for name in names:
+            try:
+                yield FileStat(name, typemode=None, dirname=self.dir.path)
+            except InvalidEncodingError:
+                continue
+
+    def verify(self, start, height):
+        files = self.dir.files
+        i = start
+        while i < min(start+height, len(files)):
+            f = files[i]
+            if not f.loaded():
+                try:
+                    f.setstat(os.lstat(f.get_path()))
+                except OSError:
+                    del files[i]
+                    self.dir.mark_files.discard(f)
+                    continue
+            i += 1
+
+    def poll(self):
+        if self.dir.listloader is not self or self.dir.list is not self.list:
+            self.cancel()
+            return False
+        with self.lock:
+            done = self.done
+            if done or len(self.found) >= max(self.chunksize, len(self.dir.files) // 4):
+                found = self.found
+                self.found = []
+            else:
+                found = []
+        if found:
+            self.count += len(found)
+            self.dir.add_list(found)
+        if done:
+            self.active = False
+            self.dir.list_title = "File:({0})".format(self.path)
+            if StatPool.workers > 0 and self.dir.sort_needs_type():
+                self.dir.pool_stats()
+            if self.error:
+                message.exception(self.error)
+            return False
+        self.dir.list_title = "File:({0}) {1}...".format(self.path, self.count)
+        return True
+
 class Pager(ListBox):
+    blocksize = 1024 * 1024
+    indexblocks = 16
+    maxline = 4096
+    hexwidth = 16
+
     def __init__(self, directory):
         ListBox.__init__(self)
         self.dir = directory
+        self.path = None
+        self.file = None
+        self.size = 0
+        self.top = 0
+        self.counts = [0]
+        self.hexmode = False
+        self.follow = False
 
     def refresh(self):
         y, x = self.dir.screen.win.getmaxyx()
@@ -1182,24 +1686,235 @@ class Pager(ListBox):
         self.panel.resize(y, x, by, bx)
 
     def preview(self, path):
+        self.close()
         path = os.path.expanduser(path)
-        entries = []
-        with open(path, "r") as fd:
-            for line in fd:
-                line = line.strip(os.linesep)
-                try:
-                    line = line.decode()
-                    line = re.sub(r"[\r]", "", line).expandtabs()
-                    attr = 0
-                except UnicodeError:
-                    line = "????? - Invalid encoding"
-                    attr = look.colors["ErrorMessage"]
-                entries.append(Entry(line, attr=attr))
-        self.show(entries)
+        try:
+            self.file = open(path, "rb")
+            self.path = path
+            self.restat()
+        except (IOError, OSError, ValueError) as e:
+            self.close()
+            return message.exception(e)
+        self.top = 0
+        self.hexmode = b"\0" in self.read(0, 8192)
+        self.follow = False
+        self.panel.show()
+        Poller.register(self.poll)
+
+    def hide(self):
+        Poller.unregister(self.poll)
+        self.close()
+        self.panel.hide()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.size = 0
+        self.counts = [0]
+
+    def restat(self):
+        size = os.fstat(self.file.fileno()).st_size
+        if size == self.size:
+            return False
+        if size < self.size:
+            self.counts = [0]
+            self.top = 0
+        self.size = size
+        return True
+
+    def read(self, start, end):
+        # The file is read with pread rather than mapped: a followed log
+        # may be truncated at any time, and touching a mapping past the
+        # new end of file kills the process with SIGBUS.
+        end = min(end, self.size)
+        if self.file is None or start >= end:
+            return b""
+        try:
+            return _pread(self.file, end-start, start)
+        except (IOError, OSError):
+            return b""
+
+    def poll(self):
+        if not self.panel.active or self.file is None:
+            return False
+        try:
+            if self.restat() and self.follow:
+                self.setbottom()
+        except (IOError, OSError, ValueError) as e:
+            self.hide()
+            message.exception(e)
+            return False
+        if not self.hexmode:
+            self.index(self.top, self.indexblocks)
+        return self.follow or self.indexing()
+
+    def indexing(self):
+        if self.hexmode:
+            return False
+        blocks = len(self.counts)
+        return blocks <= self.top // self.blocksize and blocks * self.blocksize <= self.size
+
+    def index(self, pos, blocks=None):
+        while len(self.counts) <= pos // self.blocksize:
+            if blocks is not None:
+                if blocks <= 0:
+                    break
+                blocks -= 1
+            start = (len(self.counts)-1) * self.blocksize
+            data = self.read(start, start + self.blocksize)
+            if len(data) < self.blocksize:
+                break
+            self.counts.append(self.counts[-1] + data.count(b"\n"))
+
+    def lineno(self, pos):
+        k = pos // self.blocksize
+        if k >= len(self.counts):
+            return None
+        start = k * self.blocksize
+        return self.counts[k] + self.read(start, pos).count(b"\n") + 1
+
+    def height(self):
+        if not self.panel.win:
+            return 1
+        return max(self.panel.win.getmaxyx()[0]-2, 1)
+
+    def nextline(self, pos):
+        if self.hexmode:
+            return min(pos + self.hexwidth, self.size)
+        while pos < self.size:
+            data = self.read(pos, pos + self.maxline)
+            if not data:
+                break
+            i = data.find(b"\n")
+            if i >= 0:
+                return pos + i + 1
+            pos += len(data)
+        return self.size
+
+    def prevline(self, pos):
+        if pos <= 0:
+            return 0
+        if self.hexmode:
+            return max((pos-1) // self.hexwidth * self.hexwidth, 0)
+        end = pos - 1
+        while end > 0:
+            start = max(end - self.maxline, 0)
+            i = self.read(start, end).rfind(b"\n")
+            if i >= 0:
+                return start + i + 1
+            end = start
+        return 0
+
+    def lastline(self):
+        if self.size == 0:
+            return 0
+        if self.hexmode:
+            return (self.size-1) // self.hexwidth * self.hexwidth
+        return self.prevline(self.size)
+
+    def mvscroll(self, amount):
+        if not self.size:
+            return
+        if amount > 0:
+            last = self.lastline()
+            for i in range(amount):
+                if self.top >= last:
+                    break
+                self.top = self.nextline(self.top)
+        else:
+            for i in range(-amount):
+                if self.top <= 0:
+                    break
+                self.top = self.prevline(self.top)
+        Poller.register(self.poll)
+
+    def mvcursor(self, amount):
+        self.mvscroll(amount)
+
+    def pagedown(self):
+        self.mvscroll(self.height())
+
+    def pageup(self):
+        self.mvscroll(-self.height())
+
+    def settop(self):
+        self.follow = False
+        self.top = 0
+
+    def setbottom(self):
+        self.top = self.lastline()
+        self.mvscroll(-(self.height()-1))
+
+    def toggle_follow(self):
+        self.follow = not self.follow
+        if self.follow:
+            self.setbottom()
+        Poller.register(self.poll)
+
+    def toggle_hexmode(self):
+        self.hexmode = not self.hexmode
+        if self.hexmode:
+            self.top = self.top // self.hexwidth * self.hexwidth
+        else:
+            self.top = self.prevline(self.top+1)
+            Poller.register(self.poll)
+
+    def readline(self, pos):
+        if self.hexmode:
+            data = self.read(pos, pos+self.hexwidth)
+            codes = bytearray(data)
+            hexs = " ".join("{0:02x}".format(c) for c in codes)
+            chars = "".join(chr(c) if 0x20 <= c < 0x7f else "." for c in codes)
+            text = "{0:08x}  {1:<{2}}  {3}".format(pos, hexs, self.hexwidth*3-1, chars)
+            return (text, pos + len(data))
+        data = self.read(pos, pos+self.maxline)
+        i = data.find(b"\n")
+        if i >= 0:
+            data = data[:i+1]
+            nextpos = pos + i + 1
+        else:
+            nextpos = self.nextline(pos + len(data))
+        text = data.decode("utf-8", "replace").rstrip("\r\n").expandtabs()
+        text = re.sub(r"[\x00-\x08\x0a-\x1f\x7f]", "?", text)
+        return (text, nextpos)
+
+    def draw(self):
+        self.panel.create_window()
+        win = self.panel.win
+        y, x = win.getmaxyx()
+        height = y - 2
+        width = x - 4
+        win.erase()
+        win.border(*self.borders)
+        pos = self.top
+        for line in range(1, height+1):
+            if pos >= self.size:
+                break
+            text, pos = self.readline(pos)
+            win.addstr(line, 2, util.mbs_ljust(text, width))
+        win.addstr(0, 2, util.mbs_ljust(self.status(), width), look.colors["ListBoxTitle"])
+        win.noutrefresh()
+
+    def status(self):
+        if self.size:
+            percent = 100 * min(self.top + 1, self.size) // self.size
+        else:
+            percent = 100
+        if self.hexmode:
+            pos = "{0:#x}".format(self.top)
+        else:
+            lineno = self.lineno(self.top)
+            pos = "line {0}".format("?" if lineno is None else lineno)
+        status = "{0} [{1}] {2}%".format(util.replhome(self.path), pos, percent)
+        if self.follow:
+            status += " (follow)"
+        return status
 
 class Finder(TextBox):
     smartcase = True
     migemo = None
+    fuzzy = False
 
     class History(object):
         history = [""]
@@ -1226,6 +1941,8 @@ class Finder(TextBox):
         self.dir = directory
         self.results = []
         self.cache = []
+        self.index = None
+        self.lastpattern = None
         self.startfname = ""
         self.history = self.History()
         self.refresh()
@@ -1242,9 +1959,26 @@ class Finder(TextBox):
 
     def find(self, pattern):
         if not pattern:
-            self.results = self.cache
-            self.dir.reload()
+            self.results = self.cache[:]
+            self.lastpattern = pattern
+            self.dir.setfiles(self.results)
             return
+        if self.fuzzy:
+            self.results = self.fuzzy_find(pattern)
+        else:
+            results = self.regex_find(pattern)
+            if results is None:
+                return
+            self.results = results
+        self.lastpattern = pattern
+        self.dir.setfiles(self.results)
+        idx = self.dir.get_index(self.startfname)
+        if idx and not self.fuzzy:
+            self.dir.setcursor(idx)
+        else:
+            self.dir.setcursor(1)
+
+    def regex_find(self, pattern):
         try:
             if self.smartcase and re.match("[A-Z]", pattern) is None:
                 if self.migemo:
@@ -1255,14 +1989,41 @@ class Finder(TextBox):
                     pattern = self.migemo.query(pattern)
                 r = re.compile(pattern)
         except (re.error, AssertionError):
-            return
-        self.results = [f for f in self.cache if r.search(f)]
-        self.dir.reload()
-        idx = self.dir.get_index(self.startfname)
-        if idx:
-            self.dir.setcursor(idx)
+            return None
+        if self.narrowable(pattern):
+            files = self.results
         else:
-            self.dir.setcursor(1)
+            files = self.cache
+        return [f for f in files if r.search(f.name)]
+
+    def fuzzy_find(self, pattern):
+        ignorecase = self.smartcase and pattern == pattern.lower()
+        return self.index.search(pattern, ignorecase)
+
+    def narrowable(self, pattern):
+        if self.migemo or not self.lastpattern:
+            return False
+        if re.search(r"[\\.^$*+?{}\[\]|()]", pattern):
+            return False
+        return pattern.startswith(self.lastpattern)
+
+    def sort(self, kind, rev=False):
+        self.cache = self.dir.sorted_files(self.cache, kind, rev)
+        self.reindex()
+        if self.fuzzy and self.lastpattern:
+            self.results = self.fuzzy_find(self.lastpattern)
+            self.dir.setfiles(self.results)
+        else:
+            results = set(self.results)
+            self.results = [f for f in self.cache if f in results]
+
+    def update(self, files):
+        fresh = dict((f.name, f) for f in files if f.name != os.pardir)
+        names = set(f.name for f in self.results)
+        self.cache = [fresh.get(f.name, f) for f in self.cache
+                      if f.name in fresh or f.name not in names]
+        self.reindex()
+        self.results = list(fresh.values())
 
     def select_result(self):
         if len(self.dir.files) == 1:
@@ -1277,20 +2038,32 @@ class Finder(TextBox):
         self.find(self.text)
 
     def start(self):
-        if self.migemo:
+        if self.fuzzy:
+            self.prompt = " Finder(fuzzy): "
+        elif self.migemo:
             self.prompt = " Finder(migemo): "
         else:
             self.prompt = " Finder: "
         self.show()
-        self.cache = [f.name for f in self.dir.files if f.name != os.pardir]
+        self.cache = [f for f in self.dir.files if f.name != os.pardir]
+        self.results = self.cache[:]
+        self.reindex()
+        self.lastpattern = None
         self.startfname = self.dir.file.name
         self.find(self.text)
 
+    def reindex(self):
+        if self.fuzzy:
+            self.index = FuzzyIndex(self.cache)
+        else:
+            self.index = None
+
     def finish(self):
         self.history.add(self.text)
         self.history.pos = 0
         self.results[:] = []
         self.cache[:] = []
+        self.index = None
         self.hide()
         self.select_result()
 
@@ -1302,9 +2075,157 @@ class Finder(TextBox):
         else:
             return True
 
+class FuzzyIndex(object):
+    # Maps each character to the names that contain it and its first
+    # position in each of them.  A query starts from those positions and
+    # every further character extends the previous matches with one
+    # str.find, so typing only rescores the previous results.
+    #
+    # A match is kept as (contiguous, gap, position, length, id, start,
+    # end, substring) so that the list sorts by quality as it is:
+    # contiguous matches first, then the tightest subsequences, and ties
+    # keep the directory order.
+    def __init__(self, files):
+        self.files = files
+        self.names = [f.name for f in files]
+        self.lowers = [n.lower() for n in self.names]
+        self.ids = {}
+        self.firsts = {}
+        self.ranks = {}
+        for i, name in enumerate(self.lowers):
+            for c in set(name):
+                ids = self.ids.get(c)
+                if ids is None:
+                    ids = self.ids[c] = array.array("I")
+                    self.firsts[c] = array.array("I")
+                ids.append(i)
+                self.firsts[c].append(name.find(c))
+        self.last = None
+
+    def rank(self, c):
+        ranked = self.ranks.get(c)
+        if ranked is None:
+            ids = self.ids.get(c, ())
+            names = self.names
+            lens = [len(names[i]) for i in ids]
+            order = list(range(len(ids)))
+            order.sort(key=lens.__getitem__)
+            order.sort(key=self.firsts.get(c, ()).__getitem__)
+            ranked = self.ranks[c] = [ids[j] for j in order]
+        return ranked
+
+    def begin(self, c, ignorecase, alive):
+        names = self.names
+        pairs = [(i, pos) for i, pos in zip(self.ids[c.lower()], self.firsts[c.lower()])
+                 if i in alive]
+        if not ignorecase:
+            pairs = [(i, names[i].find(c, pos)) for i, pos in pairs]
+        return [(0, 0, pos, len(names[i]), i, pos, pos, pos) for i, pos in pairs if pos >= 0]
+
+    def extend(self, matches, pattern, ignorecase):
+        names = self.lowers if ignorecase else self.names
+        c = pattern[-1]
+        extended = []
+        append = extended.append
+        for key, gap, pos, size, i, start, end, sub in matches:
+            name = names[i]
+            end = name.find(c, end+1)
+            if end < 0:
+                continue
+            if sub >= 0 and not name.startswith(pattern, sub):
+                sub = name.find(pattern, sub+1)
+            if sub >= 0:
+                append((0, 0, sub, size, i, start, end, sub))
+            else:
+                append((1, end-start, start, size, i, start, end, sub))
+        return extended
+
+    def search(self, pattern, ignorecase=True):
+        if ignorecase:
+            pattern = pattern.lower()
+        matches = None
+        if self.last:
+            lastpattern, lastcase, lastmatches = self.last
+            if lastcase == ignorecase and pattern.startswith(lastpattern):
+                matches = lastmatches
+        if ignorecase and len(pattern) == 1:
+            self.last = (pattern, ignorecase, None)
+            return [self.files[i] for i in self.rank(pattern)]
+
+        if matches is None:
+            # Only the names holding the rarest of the other characters
+            # can match, which keeps the first pass short.
+            idlists = [self.ids.get(c, ()) for c in set(pattern.lower())]
+            if all(idlists):
+                alive = set(min(idlists, key=len))
+                matches = self.begin(pattern[0], ignorecase, alive)
+            else:
+                matches = []
+            done = 1
+        else:
+            done = len(self.last[0])
+        for n in range(done, len(pattern)):
+            matches = self.extend(matches, pattern[:n+1], ignorecase)
+        matches.sort()
+        self.last = (pattern, ignorecase, matches)
+        files = self.files
+        return [files[match[4]] for match in matches]
+
+def _isdir(fs, pending):
+    # While stats are pending, entries whose type is still unknown sort
+    # as files instead of being stat'ed in the UI thread.
+    if pending and not fs.typed():
+        return False
+    return fs.isdir()
+
 class InvalidEncodingError(Exception):
     pass
 
+def _pread(fileobj, size, offset):
+    if hasattr(os, "pread"):
+        return os.pread(fileobj.fileno(), size, offset)
+    fileobj.seek(offset)
+    return fileobj.read(size)
+
+def _fsencode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding(), "surrogateescape")
+
+def _fsdecode(name):
+    if sys.version_info < (3, 0):
+        return name
+    return name.decode(sys.getfilesystemencoding(), "surrogateescape")
+
+def _entry_typemode(entry):
+    try:
+        if entry.is_symlink():
+            return stat.S_IFLNK
+        elif entry.is_dir(follow_symlinks=False):
+            return stat.S_IFDIR
+        elif entry.is_file(follow_symlinks=False):
+            return stat.S_IFREG
+    except OSError:
+        pass
+    return 0
+
+_usernames = {}
+_groupnames = {}
+_permissions = {}
+_mtimes = {}
+
+class StatView(object):
+    # Read-only stat_result look-alike built from the fields of FileStat.
+    __slots__ = ("st_mode", "st_size", "st_mtime", "st_nlink", "st_uid", "st_gid")
+
+    def __init__(self, mode, size, mtime, nlink, uid, gid):
+        self.st_mode = mode
+        self.st_size = size
+        self.st_mtime = mtime
+        self.st_nlink = nlink
+        self.st_uid = uid
+        self.st_gid = gid
+
 class FileStat(object):
     draw_ext = True
     draw_permission = True
@@ -1318,41 +2239,113 @@ class FileStat(object):
     time_week_flag = "#"
     time_yore_flag = " "
 
-    def __init__(self, name):
+    lazy = False
+
+    __slots__ = ("name", "dirname", "marked",
+                 "lmode", "mode", "size", "mtime", "nlink", "uid", "gid")
+
+    def __init__(self, name, lstat=None, typemode=0, dirname=None):
         self.marked = False
-        self.drawn_text = None
-        self.lstat = self.stat = os.lstat(name)
-        if self.islink():
-            try:
-                self.stat = os.stat(name)
-            except OSError:
-                pass
+        self.name = name
+        self.dirname = dirname
+        self.lmode = typemode
+        self.mode = self.size = self.mtime = self.nlink = self.uid = self.gid = None
+        if lstat is not None:
+            self.setstat(lstat)
+        elif typemode == 0:
+            self.setstat(os.lstat(self.get_path()))
         try:
             self.name = util.U(name)
         except UnicodeError:
-            self.name = name
             self.invalid_encoding_error()
 
+    @property
+    def lstat(self):
+        self.load()
+        return StatView(self.lmode, self.size, self.mtime, self.nlink, self.uid, self.gid)
+
+    @property
+    def stat(self):
+        self.load()
+        return StatView(self.mode, self.size, self.mtime, self.nlink, self.uid, self.gid)
+
+    def load(self):
+        if self.size is None:
+            self.statfile()
+        return self
+
+    def loaded(self):
+        return self.size is not None
+
+    def typed(self):
+        return self.lmode is not None or self.size is not None
+
+    def get_path(self):
+        if self.dirname is None:
+            return self.name
+        return os.path.join(self.dirname, self.name)
+
+    def fields(self):
+        return (self.lmode, self.mode, self.size, self.mtime, self.nlink, self.uid, self.gid)
+
+    def setfields(self, fields):
+        (self.lmode, self.mode, size, self.mtime, self.nlink, self.uid, self.gid) = fields
+        self.size = size
+
+    def setstat(self, lstat):
+        st = lstat
+        if stat.S_ISLNK(lstat.st_mode):
+            try:
+                st = os.stat(self.get_path())
+            except OSError:
+                pass
+        self.lmode = lstat.st_mode
+        self.mode = st.st_mode
+        self.mtime = st.st_mtime
+        self.nlink = st.st_nlink
+        self.uid = st.st_uid
+        self.gid = st.st_gid
+        # StatPool threads fill entries the UI thread is drawing; size is
+        # what loaded() checks, so it goes last.
+        self.size = st.st_size
+
+    def statfile(self):
+        try:
+            lstat = os.lstat(self.get_path())
+        except OSError:
+            lstat = os.stat_result((stat.S_IFMT(self.lmode or 0),) + (0,)*9)
+        self.setstat(lstat)
+
+    def _mode(self, follow=True):
+        if self.size is None:
+            if self.lmode and not (follow and stat.S_ISLNK(self.lmode)):
+                return self.lmode
+            self.statfile()
+        if follow:
+            return self.mode
+        else:
+            return self.lmode
+
     def isdir(self):
-        return stat.S_ISDIR(self.stat.st_mode)
+        return stat.S_ISDIR(self._mode())
 
     def islink(self):
-        return stat.S_ISLNK(self.lstat.st_mode)
+        return stat.S_ISLNK(self._mode(False))
 
     def isfifo(self):
-        return stat.S_ISFIFO(self.stat.st_mode)
+        return stat.S_ISFIFO(self._mode())
 
     def issocket(self):
-        return stat.S_ISSOCK(self.stat.st_mode)
+        return stat.S_ISSOCK(self._mode())
 
     def ischr(self):
-        return stat.S_ISCHR(self.lstat.st_mode)
+        return stat.S_ISCHR(self._mode(False))
 
     def isblock(self):
-        return stat.S_ISBLK(self.lstat.st_mode)
+        return stat.S_ISBLK(self._mode(False))
 
     def isexec(self):
-        return stat.S_IEXEC & self.stat.st_mode
+        return stat.S_IEXEC & self._mode()
 
     def markon(self):
         self.marked = True
@@ -1364,20 +2357,21 @@ class FileStat(object):
         self.marked = not self.marked
         return self.marked
 
-    def cache_clear(self):
-        self.drawn_text = None
+    @classmethod
+    def render_key(cls, width):
+        return (width, int(time.time() // 60), cls.draw_ext, cls.draw_permission,
+                cls.draw_nlink, cls.draw_user, cls.draw_group, cls.draw_size,
+                cls.draw_mtime, cls.time_format)
 
     def get_drawn_text(self, path, width):
-        if self.drawn_text is None:
-            fname = self.get_file_name(path)
-            fstat = self.get_file_stat()
-            namewidth = width - util.termwidth(fstat)
-            if namewidth <= 0:
-                namewidth = 0
-                fstat = util.mbs_ljust(fstat, width)
-            fname = util.mbs_ljust(fname, namewidth)
-            self.drawn_text = fname + fstat
-        return self.drawn_text
+        fname = self.get_file_name(path)
+        fstat = self.get_file_stat()
+        namewidth = width - util.termwidth(fstat)
+        if namewidth <= 0:
+            namewidth = 0
+            fstat = util.mbs_ljust(fstat, width)
+        fname = util.mbs_ljust(fname, namewidth)
+        return fname + fstat
 
     def get_file_name(self, path):
         if self.draw_ext and not self.isdir() and not self.islink():
@@ -1412,7 +2406,7 @@ class FileStat(object):
         if self.draw_group:
             fstat += " {0}".format(self.get_group_name())
         if self.draw_nlink:
-            fstat += " {0:>3}".format(self.stat.st_nlink)
+            fstat += " {0:>3}".format(self.load().nlink)
         if self.draw_size:
             if self.isdir():
                 fstat += " {0:>7}".format("<DIR>")
@@ -1440,7 +2434,7 @@ class FileStat(object):
             return 0
 
     def get_file_size(self):
-        s = self.stat.st_size
+        s = self.load().size
         if s > 1024**3:
             return "{0:.1f}G".format(float(s) / (1024**3))
         elif s > 1024**2:
@@ -1451,20 +2445,32 @@ class FileStat(object):
             return str(s)
 
     def get_user_name(self):
-        try:
-            return pwd.getpwuid(self.stat.st_uid)[0]
-        except KeyError:
-            return "unknown"
+        uid = self.load().uid
+        if uid not in _usernames:
+            try:
+                _usernames[uid] = pwd.getpwuid(uid)[0]
+            except KeyError:
+                _usernames[uid] = "unknown"
+        return _usernames[uid]
 
     def get_group_name(self):
-        try:
-            return grp.getgrgid(self.stat.st_gid)[0]
-        except KeyError:
-            return "unknown"
+        gid = self.load().gid
+        if gid not in _groupnames:
+            try:
+                _groupnames[gid] = grp.getgrgid(gid)[0]
+            except KeyError:
+                _groupnames[gid] = "unknown"
+        return _groupnames[gid]
 
     def get_mtime(self):
-        tstr = time.strftime(self.time_format, time.localtime(self.stat.st_mtime))
-        diff = time.time() - self.stat.st_mtime
+        self.load()
+        key = (self.time_format, int(self.mtime))
+        tstr = _mtimes.get(key)
+        if tstr is None:
+            if len(_mtimes) > 8192:
+                _mtimes.clear()
+            tstr = _mtimes[key] = time.strftime(self.time_format, time.localtime(self.mtime))
+        diff = time.time() - self.mtime
         if diff < 60*60*24:
             return self.time_24_flag + tstr
         elif diff < 60*60*24*7:
@@ -1473,30 +2479,35 @@ class FileStat(object):
             return self.time_yore_flag + tstr
 
     def get_permission(self):
+        self.load()
+        key = (self.lmode, self.mode)
+        if key in _permissions:
+            return _permissions[key]
         perm = ["-"] * 10
-        if stat.S_ISDIR(self.lstat.st_mode): perm[0] = "d"
-        elif stat.S_ISLNK(self.lstat.st_mode): perm[0] = "l"
-        elif stat.S_ISSOCK(self.lstat.st_mode): perm[0] = "s"
-        elif stat.S_ISFIFO(self.lstat.st_mode): perm[0] = "p"
-        elif stat.S_ISCHR(self.lstat.st_mode): perm[0] = "c"
-        elif stat.S_ISBLK(self.lstat.st_mode): perm[0] = "b"
-        if self.stat.st_mode & stat.S_IRUSR: perm[1] = "r"
-        if self.stat.st_mode & stat.S_IWUSR: perm[2] = "w"
-        if self.stat.st_mode & stat.S_IXUSR: perm[3] = "x"
-        if self.stat.st_mode & stat.S_IRGRP: perm[4] = "r"
-        if self.stat.st_mode & stat.S_IWGRP: perm[5] = "w"
-        if self.stat.st_mode & stat.S_IXGRP: perm[6] = "x"
-        if self.stat.st_mode & stat.S_IROTH: perm[7] = "r"
-        if self.stat.st_mode & stat.S_IWOTH: perm[8] = "w"
-        if self.stat.st_mode & stat.S_IXOTH: perm[9] = "x"
-        return "".join(perm)
+        if stat.S_ISDIR(self.lmode): perm[0] = "d"
+        elif stat.S_ISLNK(self.lmode): perm[0] = "l"
+        elif stat.S_ISSOCK(self.lmode): perm[0] = "s"
+        elif stat.S_ISFIFO(self.lmode): perm[0] = "p"
+        elif stat.S_ISCHR(self.lmode): perm[0] = "c"
+        elif stat.S_ISBLK(self.lmode): perm[0] = "b"
+        if self.mode & stat.S_IRUSR: perm[1] = "r"
+        if self.mode & stat.S_IWUSR: perm[2] = "w"
+        if self.mode & stat.S_IXUSR: perm[3] = "x"
+        if self.mode & stat.S_IRGRP: perm[4] = "r"
+        if self.mode & stat.S_IWGRP: perm[5] = "w"
+        if self.mode & stat.S_IXGRP: perm[6] = "x"
+        if self.mode & stat.S_IROTH: perm[7] = "r"
+        if self.mode & stat.S_IWOTH: perm[8] = "w"
+        if self.mode & stat.S_IXOTH: perm[9] = "x"
+        _permissions[key] = "".join(perm)
+        return _permissions[key]
 
     def invalid_encoding_error(self):
         perm = self.get_permission()
-        nlink = self.stat.st_nlink
+        nlink = self.nlink
         user = self.get_user_name()
         group = self.get_group_name()
-        size = "{0} ({1})".format(self.get_file_size(), self.stat.st_size)
+        size = "{0} ({1})".format(self.get_file_size(), self.size)
         mtime = self.get_mtime()
         ret = message.confirm(
             "Invalid encoding error. What do you do?",
@@ -1520,8 +2531,8 @@ class FileStat(object):
         perm = self.get_permission()
         user = self.get_user_name()
         group = self.get_group_name()
-        nlink = self.stat.st_nlink
-        size = self.stat.st_size
+        nlink = self.nlink
+        size = self.size
         mtime = self.get_mtime()
         name = self.name
         fstat = "{0} {1} {2} {3} {4} {5} {6}".format(perm, nlink, user, group, size, mtime, name)
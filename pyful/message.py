@@ -50,6 +50,7 @@ def drawhistroy():
 class Message(Widget):
     maxsave = 100
     rlock = threading.RLock()
+    confirmlock = threading.Lock()
 
     def __init__(self):
         Widget.__init__(self, "Message")
@@ -97,11 +98,12 @@ class Message(Widget):
         self.error("{0}: {1}".format(except_cls.__class__.__name__, except_cls))
 
     def confirm(self, message, options, entries=None, position=0):
-        util.global_synchro_event.wait()
-        util.global_synchro_event.clear()
-        self.confirmbox.setcursor(position)
-        ret = self.confirmbox.run(message, options, entries)
-        util.global_synchro_event.set()
+        with self.confirmlock:
+            util.global_synchro_event.wait()
+            util.global_synchro_event.clear()
+            self.confirmbox.setcursor(position)
+            ret = self.confirmbox.run(message, options, entries)
+            util.global_synchro_event.set()
         return ret
 
     def draw_histroy(self):
@@ -22,6 +22,7 @@ import re
 import time
 
 from pyful import filectrl
+from pyful import fileindex
 from pyful import look
 from pyful import message
 from pyful import process
@@ -147,7 +148,17 @@ class Chdir(Mode):
         return comp.comp_dirs()
 
     def execute(self, path, action):
-        widgets.filer.dir.chdir(path)
+        directory = widgets.filer.dir
+        if path and os.sep not in path and not os.path.isdir(util.abspath(path, directory.path)):
+            dirs = [d for d in fileindex.FileIndex.find_dirs(path) if os.path.isdir(d)]
+            if len(dirs) == 1:
+                path = dirs[0]
+            elif dirs:
+                directory.list_title = "Jump:({0})".format(path)
+                directory.list = dirs
+                directory.reload()
+                return
+        directory.chdir(path)
 
 class Chmod(Mode):
     @property
@@ -325,6 +336,30 @@ class GlobDir(Mode):
             GlobDir.default = pattern
             filer.dir.globdir(pattern)
 
+class Grep(Mode):
+    default = ""
+
+    @property
+    def prompt(self):
+        if self.default == "":
+            return " Grep pattern: "
+        else:
+            return " Grep pattern (default {0}): ".format(self.default)
+
+    def execute(self, pattern, action):
+        filer = widgets.filer
+        if pattern == "":
+            pattern = self.default
+            if pattern == "":
+                return
+        Grep.default = pattern
+        if filer.dir.ismark():
+            paths = filer.dir.get_mark_files()
+        else:
+            paths = [filer.dir.path]
+        widgets.cmdline.output.search(pattern, paths, filer.dir.path)
+        return (pattern, -1)
+
 class Help(Mode):
     prompt = " Help: "
 
@@ -91,9 +91,16 @@ pyful.filer.Directory.scroll_type = "HalfScroll"
 # Set statusbar format in directory.
 pyful.filer.Directory.statusbar_format = " [{MARK}/{FILE}] {MARKSIZE}bytes {SCROLL}({CURSOR}) {SORT} "
 
+# Watch directories with inotify and update them incrementally?
+pyful.watcher.Watcher.enable = True
+
 # Distinguish upper case and lower case at a finder?
 pyful.filer.Finder.smartcase = True
 
+# Match file names by subsequence and rank them at a finder?
+# The fuzzy engine takes precedence over migemo.
+pyful.filer.Finder.fuzzy = False
+
 # Set PyMigemo and migemo dictionary.
 # It is necessary to install PyMigemo to use migemo.
 try:
@@ -103,6 +110,60 @@ try:
 except (ImportError, ValueError):
     pyful.filer.Finder.migemo = None
 
+# Read the status of files lazily?
+# When enabled, only the files displayed on the screen, the files needed
+# by the sort kind and the mark files are stat'ed.  It speeds up entering
+# large directories on slow file systems such as NFS and FUSE.
+pyful.filer.FileStat.lazy = False
+
+# Set the number of threads which stat files in parallel when a directory
+# on a network file system (NFS, CIFS, sshfs, FUSE, etc.) is read.
+# The directory is shown at once and completed while the threads run.
+# 0 disables the parallel stat.
+pyful.filer.StatPool.workers = 8
+# Use the parallel stat on local file systems too?
+pyful.filer.StatPool.always = False
+
+# Set the number of file entries kept in the directory listing cache.
+# Panes and history showing an unchanged directory share the listing.
+# 0 disables the cache.
+pyful.filer.ListingCache.maxentries = 100000
+
+# Set the number of threads walking subdirectories in globdir.
+pyful.filer.GlobSearch.workers = 4
+
+# Set the directory trees kept in the persistent file name index.
+# Globdir, glob and chdir by name look up the index instead of walking
+# the trees.  The index is stored in the path and refreshed in the
+# background when it is older than the interval in seconds.
+# An empty list disables the index.
+pyful.fileindex.FileIndex.roots = []
+pyful.fileindex.FileIndex.path = "~/.pyful/index"
+pyful.fileindex.FileIndex.interval = 3600
+
+# Set the number of file jobs which run at the same time and the number
+# of jobs allowed on one device at a time.
+pyful.filectrl.JobScheduler.workers = 4
+pyful.filectrl.JobScheduler.device_limit = 1
+
+# Set the number of files copied at the same time within one copy job.
+# 1 copies the files one by one.
+pyful.filectrl.CopyThread.workers = 4
+
+# Set the number of threads deleting subdirectories at the same time.
+pyful.filectrl.DeleteThread.workers = 4
+
+# Set the number of threads compressing tar.gz and zip archives.
+# 1 compresses on a single thread.
+pyful.filectrl.TarThread.workers = 4
+pyful.filectrl.ZipThread.workers = 4
+
+# Set the number of archives created at the same time by tareach and zipeach.
+pyful.filectrl.BatchThread.workers = 4
+
+# Set the number of threads inflating zip members at the same time.
+pyful.filectrl.UnzipThread.workers = 4
+
 # Set the time format of file.
 # It conforms to the strftime format from time module.
 pyful.filer.FileStat.time_format = "%y-%m-%d %H:%M"
@@ -162,6 +223,11 @@ pyful.widget.ui.MouseHandler.enable(False)
 pyful.cmdline.History.maxsave = 10000
 pyful.cmdline.Clipboard.maxsave = 100
 
+# Set the number of threads which search in files at grep mode and the
+# maximum number of matched lines kept in the output.
+pyful.cmdline.GrepSearch.workers = 4
+pyful.cmdline.GrepSearch.maxresults = 10000
+
 # Registration of program initialization.
 # Pyful.atinit() wraps the initialization functions.
 @pyful.Pyful.atinit
@@ -172,6 +238,7 @@ def myatinit():
     widgets.cmdline.history.loadfile("~/.pyful/history/eval", "Eval")
     widgets.cmdline.history.loadfile("~/.pyful/history/mx", "Mx")
     widgets.cmdline.history.loadfile("~/.pyful/history/replace", "Replace")
+    pyful.fileindex.FileIndex.start()
 
 # Registration of program termination.
 # Pyful.atexit() wraps the termination functions.
@@ -254,7 +321,9 @@ pyful.widget.define_key(widgets.filer, {
         "w"             : lambda: command.run("chdir_neighbor"),
         "f"             : lambda: command.run("finder_start"),
         "/"             : lambda: command.run("finder_start"),
+        "M-g"           : lambda: command.run("grep"),
         "v"             : lambda: command.run("fileviewer"),
+        "M-V"           : lambda: command.run("preview"),
         "P"             : lambda: command.run("pack"),
         "U"             : lambda: command.run("unpack2"),
         "u"             : lambda: command.run("unpack"),
@@ -271,6 +340,7 @@ pyful.widget.define_key(widgets.filer, {
         "M-x"           : lambda: command.run("mx"),
         "M-m"           : lambda: command.run("menu"),
         "K"             : lambda: command.run("kill_thread"),
+        "M-K"           : lambda: command.run("view_jobs"),
         "?"             : lambda: command.run("help"),
         "M-?"           : lambda: command.run("help_all"),
         "c"             : lambda: command.run("copy"),
@@ -311,6 +381,31 @@ pyful.widget.define_key(widgets.filer.finder, {
         "<backspace>" : lambda: widgets.filer.finder.delete_backward_char(),
         })
 
+pyful.widget.define_key(widgets.filer.pager, {
+        "j"      : lambda: widgets.filer.pager.mvscroll(+1),
+        "C-n"    : lambda: widgets.filer.pager.mvscroll(+1),
+        "<down>" : lambda: widgets.filer.pager.mvscroll(+1),
+        "k"      : lambda: widgets.filer.pager.mvscroll(-1),
+        "C-p"    : lambda: widgets.filer.pager.mvscroll(-1),
+        "<up>"   : lambda: widgets.filer.pager.mvscroll(-1),
+        "C-v"    : lambda: widgets.filer.pager.pagedown(),
+        "C-d"    : lambda: widgets.filer.pager.pagedown(),
+        "SPC"    : lambda: widgets.filer.pager.pagedown(),
+        "<npage>": lambda: widgets.filer.pager.pagedown(),
+        "M-v"    : lambda: widgets.filer.pager.pageup(),
+        "C-u"    : lambda: widgets.filer.pager.pageup(),
+        "<ppage>": lambda: widgets.filer.pager.pageup(),
+        "g"      : lambda: widgets.filer.pager.settop(),
+        "M-<"    : lambda: widgets.filer.pager.settop(),
+        "G"      : lambda: widgets.filer.pager.setbottom(),
+        "M->"    : lambda: widgets.filer.pager.setbottom(),
+        "F"      : lambda: widgets.filer.pager.toggle_follow(),
+        "x"      : lambda: widgets.filer.pager.toggle_hexmode(),
+        "q"      : lambda: widgets.filer.pager.hide(),
+        "C-g"    : lambda: widgets.filer.pager.hide(),
+        "ESC"    : lambda: widgets.filer.pager.hide(),
+        })
+
 pyful.widget.define_key(widgets.cmdline, {
         "C-f"         : lambda: widgets.cmdline.forward_char(),
         "<right>"     : lambda: widgets.cmdline.forward_char(),
@@ -597,6 +692,7 @@ pyful.menu.define_menu("Tool", (
     ("Command"         ,  "M-x" , lambda: command.run("mx")),
     ("Glob search"     ,  "g"   , lambda: command.run("glob")),
     ("Glob recursive"  ,  "G"   , lambda: command.run("globdir")),
+    ("Search in files" ,  "s"   , lambda: command.run("grep")),
     ("Rehash programs" ,  "r"   , lambda: command.run("rehash_programs")),
     ("Reload rc.py"    ,  "R"   , lambda: command.run("reload_rcfile")),
     ("Editor"          ,  "E"   , lambda: widgets.menu.show("editor")),
@@ -18,6 +18,7 @@
 
 import os
 import re
+import stat
 import sys
 import threading
 import unicodedata
@@ -47,6 +48,46 @@ else:
     def force_decode(string):
         return string
 
+if hasattr(os, "scandir"):
+    scandir = os.scandir
+else:
+    class DirEntry(object):
+        def __init__(self, dirname, name):
+            self.name = name
+            self.path = os.path.join(dirname, name)
+            self._lstat = None
+            self._stat = None
+
+        def stat(self, follow_symlinks=True):
+            if not follow_symlinks:
+                if self._lstat is None:
+                    self._lstat = os.lstat(self.path)
+                return self._lstat
+            if self._stat is None:
+                self._stat = os.stat(self.path)
+            return self._stat
+
+        def is_dir(self, follow_symlinks=True):
+            try:
+                return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+            except OSError:
+                return False
+
+        def is_file(self, follow_symlinks=True):
+            try:
+                return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+            except OSError:
+                return False
+
+        def is_symlink(self):
+            try:
+                return stat.S_ISLNK(self.stat(False).st_mode)
+            except OSError:
+                return False
+
+    def scandir(path=os.curdir):
+        return iter([DirEntry(path, name) for name in os.listdir(path)])
+
 def cmp_to_key(_cmp):
     class K(object):
         def __init__(self, obj, *args):
@@ -225,6 +266,25 @@ def path_omission(path, width):
                 break
     return path
 
+def get_fstype(path):
+    fstype = None
+    mountpoint = ""
+    try:
+        with open("/proc/mounts", "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mnt = fields[1].replace("\\040", " ")
+                if path != mnt and not path.startswith(mnt.rstrip(os.sep) + os.sep):
+                    continue
+                if len(mnt) >= len(mountpoint):
+                    mountpoint = mnt
+                    fstype = fields[2]
+    except (IOError, OSError):
+        pass
+    return fstype
+
 def replhome(path):
     homedir = os.getenv("HOME")
     if path.startswith(homedir):
@@ -0,0 +1,184 @@
+# watcher.py - directory watcher with inotify
+#
+# Copyright (C) 2010-2011 anmitsu <anmitsu.s@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+from pyful.widget.ui import Poller
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_event = struct.Struct("iIII")
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+def _encode(path):
+    if isinstance(path, bytes):
+        return path
+    if sys.version_info < (3, 0):
+        return path.encode(sys.getfilesystemencoding())
+    return path.encode(sys.getfilesystemencoding(), "surrogateescape")
+
+def _decode(name):
+    if sys.version_info < (3, 0):
+        return name
+    return name.decode(sys.getfilesystemencoding(), "surrogateescape")
+
+class Watcher(object):
+    enable = True
+    mask = (IN_CREATE | IN_DELETE | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+            IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+    def __init__(self):
+        self.libc = None
+        self.fd = -1
+        self.watches = {}
+        self.dirs = {}
+
+    def open(self):
+        if self.fd >= 0:
+            return True
+        if self.libc is None:
+            self.libc = _load_libc()
+            if self.libc is None:
+                self.enable = False
+                return False
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return False
+        self.fd = fd
+        return True
+
+    def watching(self, d):
+        return self.enable and d in self.dirs
+
+    def watch(self, d):
+        if not self.enable:
+            self.unwatch(d)
+            return False
+        if d in self.dirs:
+            if self.dirs[d][1] == d.path:
+                return True
+            self.unwatch(d)
+        if not self.open():
+            return False
+        wd = self.libc.inotify_add_watch(self.fd, _encode(d.path), self.mask)
+        if wd < 0:
+            return False
+        self.watches.setdefault(wd, []).append(d)
+        self.dirs[d] = (wd, d.path)
+        Poller.register_fd(self.fd, self.poll)
+        return True
+
+    def unwatch(self, d):
+        if d not in self.dirs:
+            return
+        wd, path = self.dirs.pop(d)
+        dirs = self.watches.get(wd, [])
+        if d in dirs:
+            dirs.remove(d)
+        if not dirs:
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                break
+            if not buf:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, cookie, length = _event.unpack_from(buf, pos)
+                pos += _event.size
+                name = buf[pos:pos+length].rstrip(b"\0")
+                pos += length
+                events.append((wd, mask, _decode(name)))
+        return events
+
+    def poll(self):
+        if self.fd < 0:
+            return False
+        events = self.read()
+        if events:
+            self.dispatch(events)
+        return len(self.dirs) != 0
+
+    def dispatch(self, events):
+        changes = {}
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                for d in self.dirs:
+                    changes[d] = None
+                continue
+            for d in self.watches.get(wd, []):
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    changes[d] = None
+                elif name and changes.get(d, ()) is not None:
+                    changes.setdefault(d, set()).add(name)
+
+        reloaded = False
+        for d, names in changes.items():
+            if names is None:
+                self.unwatch(d)
+                d.reload()
+                reloaded = True
+            else:
+                d.apply_changes(names)
+        if reloaded:
+            from pyful import widgets
+            try:
+                os.chdir(widgets.filer.dir.path)
+            except OSError:
+                pass
+
+watcher = Watcher()
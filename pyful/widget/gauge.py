@@ -24,8 +24,9 @@ class ProgressGauge(object):
     eta_format = "%H:%M:%S"
     units = ("B", "K", "M", "G", "T")
 
-    def __init__(self, maxval):
+    def __init__(self, maxval, countfiles=False):
         self.maxval = float(maxval)
+        self.countfiles = countfiles
         self.curval = 0.0
         self.start_time = None
         self.elapsed_time = 0.0
@@ -43,6 +44,8 @@ class ProgressGauge(object):
             bps = self.curval / self.elapsed_time
         except ZeroDivisionError:
             bps = 0.0
+        if self.countfiles:
+            return "{0:>6.1f} files/s".format(bps)
         for unit in self.units:
             if bps < 1024:
                 bps_text = "{0:>6.1f}{1}/s".format(bps, unit)
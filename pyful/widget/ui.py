@@ -16,6 +16,8 @@
 
 import array
 import curses
+import select
+import sys
 
 from pyful.widget import base
 
@@ -43,13 +45,76 @@ class Drawer(object):
         curses.setsyx(*self.screen.getmaxyx())
         curses.doupdate()
 
+class Poller(object):
+    interval = 100
+    tasks = []
+    fds = {}
+
+    @classmethod
+    def register(cls, task):
+        if task not in cls.tasks:
+            cls.tasks.append(task)
+
+    @classmethod
+    def unregister(cls, task):
+        if task in cls.tasks:
+            cls.tasks.remove(task)
+
+    @classmethod
+    def register_fd(cls, fd, task):
+        cls.fds[fd] = task
+
+    @classmethod
+    def unregister_fd(cls, fd):
+        cls.fds.pop(fd, None)
+
+    @classmethod
+    def poll(cls):
+        for task in cls.tasks[:]:
+            if not task():
+                cls.unregister(task)
+        if cls.fds:
+            cls.wait(0)
+
+    @classmethod
+    def wait(cls, timeout=None, infd=None):
+        fds = list(cls.fds)
+        if infd is not None:
+            fds.append(infd)
+        try:
+            readable = select.select(fds, [], [], timeout)[0]
+        except (select.error, OSError, ValueError):
+            return []
+        for fd in readable:
+            task = cls.fds.get(fd)
+            if task is not None and not task():
+                cls.unregister_fd(fd)
+        return readable
+
 class Controller(object):
+    resize_interval = 1.0
+
     def __init__(self, inputfunc, screen=None):
         self.input = inputfunc
         self.keyhandler = KeyHandler(screen)
+        self.timeout = -1
 
     def control(self):
-        key = self.keyhandler.getkey()
+        if Poller.tasks:
+            self.keyhandler.screen.timeout(Poller.interval)
+            key = self.keyhandler.getkey()
+            self.keyhandler.screen.timeout(-1)
+            Poller.poll()
+        elif self.timeout >= 0:
+            self.keyhandler.screen.timeout(self.timeout)
+            key = self.keyhandler.getkey()
+            self.keyhandler.screen.timeout(-1)
+            if Poller.fds:
+                Poller.wait(0)
+        elif Poller.fds:
+            key = self.wait()
+        else:
+            key = self.keyhandler.getkey()
         if key != -1:
             if key == "<resize>":
                 base.Widget.refresh_all_widgets()
@@ -59,6 +124,25 @@ class Controller(object):
             else:
                 self.input(key)
 
+    def wait(self):
+        # Sleep until a key or a registered file descriptor is ready.  The
+        # timeout only lets getch notice a terminal resize.
+        infd = sys.stdin.fileno()
+        while Poller.fds and not Poller.tasks:
+            readable = Poller.wait(self.resize_interval, infd)
+            if infd in readable:
+                break
+            if readable:
+                return -1
+            self.keyhandler.screen.timeout(0)
+            key = self.keyhandler.getkey()
+            self.keyhandler.screen.timeout(-1)
+            if key != -1:
+                return key
+        if Poller.tasks:
+            return -1
+        return self.keyhandler.getkey()
+
 class MouseHandler(object):
     buttons = {}
 
@@ -126,7 +210,9 @@ class KeyHandler(object):
                 key = "ESC"
             else:
                 key = self._get_key_for(self.screen.getch(), escaped=True)
-                if key != "ESC":
+                if key == -1:
+                    key = "ESC"
+                elif key != "ESC":
                     key = "M-" + key
         elif ch == 13:
             key = "RET"
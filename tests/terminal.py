@@ -0,0 +1,51 @@
+import os
+import pickle
+import pty
+import sys
+import traceback
+
+def run(func, *args):
+    """Call func(*args) in a child process attached to a pseudo terminal.
+
+    Job threads and widgets need curses, which needs a terminal.  The
+    return value (or the traceback) is sent back pickled.
+    """
+    rfd, wfd = os.pipe()
+    pid, master = pty.fork()
+    if pid == 0:
+        os.close(rfd)
+        os.environ["TERM"] = "xterm"
+        try:
+            from pyful import Pyful, look, widget
+            widget.start_curses()
+            Pyful()
+            look.init_colors()
+            widget.refresh_all_widgets()
+            result = (True, func(*args))
+        except BaseException:
+            result = (False, traceback.format_exc())
+        try:
+            import curses
+            curses.endwin()
+        except Exception:
+            pass
+        with os.fdopen(wfd, "wb") as f:
+            pickle.dump(result, f)
+        os._exit(0)
+    os.close(wfd)
+    while True:
+        try:
+            if not os.read(master, 4096):
+                break
+        except OSError:
+            break
+    with os.fdopen(rfd, "rb") as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    os.close(master)
+    if not data:
+        raise RuntimeError("terminal child died")
+    ok, result = pickle.loads(data)
+    if not ok:
+        raise AssertionError(result)
+    return result
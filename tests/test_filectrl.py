@@ -0,0 +1,82 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import terminal
+
+def _untar(source, dstdir):
+    from pyful import filectrl
+    thread = filectrl.UntarThread(source, dstdir)
+    thread.extract(source)
+    return [os.stat(os.path.join(dstdir, name)).st_ino for name in ("d/a", "d/b", "c")]
+
+class TestUntar(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stream_hardlinks(self):
+        src = os.path.join(self.tmpdir, "src")
+        os.makedirs(os.path.join(src, "d"))
+        with open(os.path.join(src, "d", "a"), "w") as f:
+            f.write("hello\n")
+        os.link(os.path.join(src, "d", "a"), os.path.join(src, "d", "b"))
+        os.link(os.path.join(src, "d", "a"), os.path.join(src, "c"))
+        source = os.path.join(self.tmpdir, "a.tgz")
+        with tarfile.open(source, "w:gz") as tar:
+            tar.add(os.path.join(src, "d"), "d")
+            tar.add(os.path.join(src, "c"), "c")
+        dstdir = os.path.join(self.tmpdir, "dst")
+        os.makedirs(dstdir)
+
+        inodes = terminal.run(_untar, source, dstdir)
+        self.assertEqual(len(set(inodes)), 1)
+        with open(os.path.join(dstdir, "c")) as f:
+            self.assertEqual(f.read(), "hello\n")
+
+class TestParallelZip(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        from pyful.filectrl import ParallelZipWriter
+        contents = {
+            "empty": b"",
+            "small.txt": b"hello\n",
+            "big.log": b"".join(b"line %d of a log\n" % i for i in range(100000)),
+            "random.bin": os.urandom(300000),
+        }
+        for name, data in contents.items():
+            with open(os.path.join(self.tmpdir, name), "wb") as f:
+                f.write(data)
+        os.makedirs(os.path.join(self.tmpdir, "sub"))
+        dst = os.path.join(self.tmpdir, "a.zip")
+        added = []
+        with zipfile.ZipFile(dst, "w", compression=zipfile.ZIP_DEFLATED) as myzip:
+            self.assertTrue(ParallelZipWriter.usable(myzip))
+            pipeline = ParallelZipWriter(myzip, 4, lambda arcname, size: added.append(arcname))
+            for name in sorted(contents):
+                path = os.path.join(self.tmpdir, name)
+                pipeline.deflate(path, name, name)
+            path = os.path.join(self.tmpdir, "sub")
+            pipeline.write(lambda: myzip.write(path, "sub"), 0, "sub")
+            pipeline.close()
+        self.assertEqual(added, sorted(contents) + ["sub"])
+
+        with zipfile.ZipFile(dst) as myzip:
+            self.assertIsNone(myzip.testzip())
+            self.assertEqual(myzip.namelist(), sorted(contents) + ["sub/"])
+            for name, data in contents.items():
+                self.assertEqual(myzip.read(name), data)
+                self.assertEqual(myzip.getinfo(name).compress_type, zipfile.ZIP_DEFLATED)
+
+if __name__ == "__main__":
+    unittest.main()
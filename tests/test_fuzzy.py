@@ -0,0 +1,67 @@
+import random
+import re
+import time
+import unittest
+
+from pyful.filer import FuzzyIndex
+
+class Entry(object):
+    def __init__(self, name):
+        self.name = name
+
+def _names(count):
+    rand = random.Random(0)
+    words = ["src", "test", "main", "util", "config", "data", "image", "report",
+             "log", "backup", "Module", "index", "final", "draft", "v2", "old"]
+    names = set()
+    while len(names) < count:
+        stem = "_".join(rand.choice(words) for i in range(rand.randint(1, 3)))
+        ext = rand.choice([".py", ".txt", ".jpg", ".c", ""])
+        names.add("{0}{1}{2}".format(stem, rand.randint(0, 99999), ext))
+    return sorted(names)
+
+def _timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return (time.time() - start, result)
+
+class TestFuzzyIndex(unittest.TestCase):
+    def test_ranking(self):
+        names = ["xconfig", "c_o_n_f", "config", "conf.txt", "bar", "CONFIG.old"]
+        index = FuzzyIndex([Entry(n) for n in names])
+        found = [f.name for f in index.search("conf")]
+        self.assertEqual(found, ["config", "conf.txt", "CONFIG.old", "xconfig", "c_o_n_f"])
+        found = [f.name for f in index.search("CONF", ignorecase=False)]
+        self.assertEqual(found, ["CONFIG.old"])
+
+    def test_narrowing_matches_full_search(self):
+        files = [Entry(n) for n in _names(5000)]
+        index = FuzzyIndex(files)
+        pattern = ""
+        for c in "cnfgrt":
+            pattern += c
+            found = index.search(pattern)
+            regex = re.compile(".*?".join(re.escape(ch) for ch in pattern), re.IGNORECASE)
+            expected = set(f.name for f in files if regex.search(f.name))
+            self.assertEqual(set(f.name for f in found), expected)
+            fresh = FuzzyIndex(files).search(pattern)
+            self.assertEqual([f.name for f in found], [f.name for f in fresh])
+
+    def test_typing_on_large_list(self):
+        files = [Entry(n) for n in _names(100000)]
+        index = FuzzyIndex(files)
+        lowers = [f.name.lower() for f in files]
+        # One linear pass over every name is the cost each keystroke has
+        # to stay below.
+        scan = min(_timeit(lambda: [n.find("c") for n in lowers])[0] for i in range(3))
+        for pattern in ("con", "conf", "confi", "config", "configp"):
+            best = None
+            for i in range(3):
+                index.search(pattern[:-1])
+                elapsed, found = _timeit(index.search, pattern)
+                self.assertTrue(found)
+                best = elapsed if best is None else min(best, elapsed)
+            self.assertLess(best, scan * 2, pattern)
+
+if __name__ == "__main__":
+    unittest.main()